@@ -0,0 +1,228 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+from database import DEFAULT_DB_URL, MAX_USERNAME_CHARS, DatabaseHandler, validate_credentials
+from hashing import PasswordHasher
+from logs import setup_logging, stop_logging
+
+FIELDS = ("username", "password_hash", "created_at", "last_login")
+FORMATS = ("csv", "jsonl")
+BATCH_SIZE = 1000
+
+def detect_format(path, fmt=None):
+    """csv or jsonl: as given, else from the file extension"""
+    if fmt:
+        return fmt
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if path.endswith(".csv"):
+        return "csv"
+    raise ValueError(f"Cannot tell the format of {path}, pass --format")
+
+def open_file(path, mode):
+    """Open path as text ('-' is stdin/stdout)"""
+    if path == "-":
+        return open((sys.stdin if "r" in mode else sys.stdout).fileno(), mode, newline="", closefd=False)
+    return open(path, mode, newline="", encoding="utf-8")
+
+def read_records(file, fmt):
+    """Yield (line number, record dict) from a CSV or JSONL file, lazily"""
+    if fmt == "csv":
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+
+def parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+class UserImporter:
+    """Bulk-loads users from CSV/JSONL records, one batch per transaction.
+
+    A record has a username and either a plain `password` (checked like a
+    registration, then hashed) or an existing bcrypt `password_hash`, e.g.
+    from an export; created_at and last_login are optional ISO timestamps.
+    Each batch is checked for existing usernames first, so no bcrypt time
+    is spent on them, then its passwords are hashed in parallel on the
+    hasher's pool and the rows are written with one executemany INSERT.
+    """
+
+    def __init__(self, db, hasher, batch_size=BATCH_SIZE):
+        self.db = db
+        self.hasher = hasher
+        self.batch_size = batch_size
+        self.imported = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.failed = 0
+
+    def run(self, records):
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                break
+            self.import_batch(batch)
+            print(f"⏳ {self.imported} imported, {self.skipped} skipped", file=sys.stderr, end="\r")
+        print(file=sys.stderr)
+        return {"imported": self.imported, "skipped": self.skipped, "invalid": self.invalid, "failed": self.failed}
+
+    def import_batch(self, batch):
+        rows = []
+        for number, record in batch:
+            row = self.make_row(number, record)
+            if row is not None:
+                rows.append(row)
+        existing = self.db.existing_usernames([row["username"] for row in rows])
+        new_rows = [row for row in rows if row["username"] not in existing]
+        self.skipped += len(rows) - len(new_rows)
+
+        to_hash = [row for row in new_rows if "password" in row]
+        passwords = [row.pop("password") for row in to_hash]
+        for row, password_hash in zip(to_hash, self.hasher.hash_passwords(passwords)):
+            row["password_hash"] = password_hash
+
+        inserted = self.db.insert_users(new_rows)
+        if inserted is None:
+            self.failed += len(new_rows)
+        else:
+            self.imported += inserted
+            self.skipped += len(new_rows) - inserted  # Duplicates within the file
+
+    def make_row(self, number, record):
+        """Validate one record and turn it into a users row (None if invalid)"""
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("not a JSON object")
+            username = (record.get("username") or "").strip()
+            password_hash = record.get("password_hash")
+            row = {
+                "username": username,
+                "created_at": parse_time(record.get("created_at")) or datetime.utcnow(),
+                "last_login": parse_time(record.get("last_login")),
+            }
+            if password_hash:
+                if not 3 <= len(username) <= MAX_USERNAME_CHARS or not password_hash.startswith("$2"):
+                    raise ValueError("bad username or bcrypt hash")
+                row["password_hash"] = password_hash.encode("ascii")
+            else:
+                error = validate_credentials(username, record.get("password"))
+                if error:
+                    raise ValueError(error)
+                row["password"] = record["password"]
+            return row
+        except (ValueError, TypeError, AttributeError) as e:
+            self.invalid += 1
+            print(f"⚠️ Line {number}: {e}", file=sys.stderr)
+            return None
+
+def export_users(db, file, fmt, batch_size=BATCH_SIZE):
+    """Stream every user to file; returns how many were written"""
+    count = 0
+    writer = csv.writer(file) if fmt == "csv" else None
+    if writer:
+        writer.writerow(FIELDS)
+    for row in db.iter_users(batch_size=batch_size):
+        values = (
+            row.username,
+            row.password_hash.decode("ascii") if isinstance(row.password_hash, bytes) else row.password_hash,
+            row.created_at.isoformat() if row.created_at else "",
+            row.last_login.isoformat() if row.last_login else "",
+        )
+        if writer:
+            writer.writerow(values)
+        else:
+            file.write(json.dumps({field: value or None for field, value in zip(FIELDS, values)}) + "\n")
+        count += 1
+    return count
+
+def list_users(db, after=None, limit=50):
+    """Print one page of users; the last line tells how to get the next"""
+    last = None
+    count = 0
+    for row in db.iter_users(after=after, limit=limit):
+        created = row.created_at.strftime("%Y-%m-%d %H:%M") if row.created_at else "-"
+        seen = row.last_login.strftime("%Y-%m-%d %H:%M") if row.last_login else "never"
+        print(f"{row.username:<30} created {created}  last seen {seen}")
+        last = row.username
+        count += 1
+    if count == limit:
+        print(f"More: --after {last}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Auth Chat Server user administration")
+    parser.add_argument(
+        "--db-url", default=DEFAULT_DB_URL,
+        help="SQLAlchemy database URL (defaults to $CHAT_DB_URL or the local SQLite file)"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="Add users from a CSV or JSONL file ('-': stdin)")
+    importer.add_argument("file")
+    importer.add_argument("--format", choices=FORMATS, default=None, help="Default: from the file extension")
+    importer.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Users per transaction")
+    importer.add_argument(
+        "--hash-workers", type=int, default=os.cpu_count() or 1,
+        help="bcrypt worker processes (default: one per core)"
+    )
+    importer.add_argument("--bcrypt-rounds", type=int, default=12, help="bcrypt cost for plain passwords")
+
+    exporter = commands.add_parser("export", help="Write every user to a CSV or JSONL file ('-': stdout)")
+    exporter.add_argument("file")
+    exporter.add_argument("--format", choices=FORMATS, default=None, help="Default: from the file extension")
+
+    lister = commands.add_parser("list", help="List users a page at a time")
+    lister.add_argument("--after", default=None, help="Start after this username")
+    lister.add_argument("--limit", type=int, default=50, help="Users per page")
+
+    commands.add_parser("stats", help="Show user counts")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Progress and logs go to stderr so exports can be piped
+    setup_logging("warning", stream=sys.stderr)
+    hasher = None
+    if args.command == "import":
+        hasher = PasswordHasher(
+            workers=args.hash_workers, kind="process",
+            # Slots of the previous batch may still be in flight being released
+            max_pending=2 * args.batch_size, rounds=args.bcrypt_rounds
+        )
+    db = DatabaseHandler(args.db_url, hasher=hasher)
+    try:
+        if args.command == "import":
+            fmt = detect_format(args.file, args.format)
+            started = time.perf_counter()
+            with open_file(args.file, "r") as file:
+                results = UserImporter(db, hasher, args.batch_size).run(read_records(file, fmt))
+            print(f"✅ {results} in {time.perf_counter() - started:.1f}s")
+        elif args.command == "export":
+            fmt = detect_format(args.file, args.format)
+            with open_file(args.file, "w") as file:
+                count = export_users(db, file, fmt)
+            print(f"✅ Exported {count} users", file=sys.stderr)
+        elif args.command == "list":
+            list_users(db, args.after, args.limit)
+        else:
+            print(f"📊 {db.get_user_stats()}")
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db.close()
+        stop_logging()
+
+if __name__ == "__main__":
+    main()
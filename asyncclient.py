@@ -0,0 +1,345 @@
+import asyncio
+import random
+import time
+from collections import deque
+from protocol import (
+    HEADER_SIZE, LEAVE_COMMAND, MAILBOX_ACK, PLAIN_CODEC, PONG, Codec, FrameError,
+    auth_request, encode_frame, hello_request, mailbox_ack, read_frame, resume_request
+)
+from rooms import DEFAULT_ROOM
+from tls import ResumingContext
+
+# Failures that mean "this connection is gone", as opposed to a refusal
+CONNECTION_ERRORS = (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError, FrameError)
+
+class AuthError(Exception):
+    """The server refused a login, registration or session token.
+
+    response is the server's reply: response.get("code") is "rate_limited"
+    (with retry_after) when the attempt may simply be repeated later.
+    """
+
+    def __init__(self, response):
+        super().__init__(response.get("message", "Authentication failed"))
+        self.response = response
+
+class AsyncChatClient:
+    """Headless chat session on an asyncio event loop; no prompts, no printing.
+
+    connect() opens the connection, then login()/register()/resume()
+    authenticate (an AuthError leaves the connection open for another
+    try). send() only queues a line and returns: a writer task pipelines
+    everything queued so far into one write. Received chat lines and
+    control messages come out of `async for event in client` as dicts
+    ({"type": "chat", "message": ...} for chat lines); pings and mailbox
+    deliveries are acknowledged internally. A frame that cannot be decoded
+    (corrupt compression stream, bad JSON) counts as a dropped connection.
+    A dropped connection is re-established in the background
+    with jittered exponential backoff (or the delay the server asked for)
+    and resumed by session token, re-joining the current room; lines sent
+    meanwhile wait in the queue. Everything is a coroutine or a task on
+    one loop, so a process can run hundreds of clients.
+
+    For measurements, on_latency(stage, seconds) is called with "connect"
+    (TCP and TLS setup) and with the request type ("login", "register",
+    "resume") once auth_success arrives; bytes_in/bytes_out count every
+    frame on the wire, headers included.
+    """
+
+    def __init__(self, host="127.0.0.1", port=5555, tls_context=None, negotiate=True,
+                 compress=False, encodings=None, reconnect_attempts=10, backoff=0.5,
+                 max_backoff=30.0, max_pending=1000, max_events=1000, timeout=10.0,
+                 on_latency=None):
+        self.host = host
+        self.port = port
+        self.tls = ResumingContext(tls_context) if tls_context is not None else None
+        self.negotiate = negotiate  # Ask for a tagged encoding when offered
+        self.compress = compress
+        self.encodings = encodings  # Preference order for hello; None: the server's choice
+        self.reconnect_attempts = reconnect_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.on_latency = on_latency
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.reader = None
+        self.writer = None
+        self.codec = PLAIN_CODEC
+        self.username = None
+        self.token = None  # Session token from auth_success, used to resume
+        self.room = DEFAULT_ROOM
+        self.reconnect_after = None  # Delay from the server's reconnect notice
+        self.closed = False
+        # Received events; when nobody consumes them the reader stops
+        # reading and the server's slow-consumer policy takes over
+        self.events = asyncio.Queue(max_events)
+        self.pending = deque()  # (is_control, message) waiting for the writer
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()  # Nothing queued and nothing being written
+        self.idle.set()
+        self.connected = asyncio.Event()  # Authenticated on a live connection
+        self.tasks = []
+
+    async def connect(self):
+        """Open the connection and negotiate an encoding; returns the greeting"""
+        started = time.perf_counter()
+        if self.tls is not None:
+            connecting = asyncio.open_connection(self.host, self.port, ssl=self.tls)
+        else:
+            connecting = asyncio.open_connection(self.host, self.port)
+        self.reader, self.writer = await asyncio.wait_for(connecting, self.timeout)
+        self.measured("connect", started)
+        self.codec = PLAIN_CODEC
+        greeting = await self.read_control()
+        if self.negotiate and greeting.get("features"):
+            self.write_now(hello_request(self.compress, self.encodings, features=[MAILBOX_ACK]))
+            ack = await self.read_control("hello_ack")
+            self.codec = Codec(ack.get("encoding"), ack.get("compression"))
+        return greeting
+
+    async def login(self, username, password):
+        return await self.authenticate(auth_request("login", username, password))
+
+    async def register(self, username, password):
+        """Create an account; the server logs it in right away"""
+        return await self.authenticate(auth_request("register", username, password))
+
+    async def resume(self, token):
+        return await self.authenticate(resume_request(token))
+
+    async def authenticate(self, request):
+        """Send an auth request; returns auth_success or raises AuthError"""
+        started = time.perf_counter()
+        self.write_now(request)
+        response = await self.read_control()
+        if response.get("type") != "auth_success":
+            if not response.get("success"):
+                raise AuthError(response)
+            response = await self.read_control("auth_success")
+        self.measured(request.get("type"), started)
+        self.token = response.get("token")
+        self.username = request.get("username") or self.username
+        if self.tls is not None:
+            # TLS 1.3 tickets arrive after the handshake: read it now
+            self.tls.session = self.writer.get_extra_info("ssl_object").session
+        self.connected.set()
+        if not self.tasks:
+            loop = asyncio.get_running_loop()
+            self.tasks = [loop.create_task(self.receive()), loop.create_task(self.flush())]
+        return response
+
+    def measured(self, stage, started):
+        if self.on_latency is not None:
+            self.on_latency(stage, time.perf_counter() - started)
+
+    async def read_control(self, expected=None):
+        """Next control message during the handshake (of type `expected`)"""
+        while True:
+            payload = await asyncio.wait_for(read_frame(self.reader), self.timeout)
+            if payload is None:
+                raise EOFError("Server closed the connection")
+            self.bytes_in += len(payload) + HEADER_SIZE
+            is_control, message = self.decode(payload)
+            if not is_control or not isinstance(message, dict):
+                continue
+            if message.get("type") == "ping":
+                self.write_now(PONG)
+            elif expected is None or message.get("type") == expected:
+                return message
+
+    def write_now(self, message):
+        frame = encode_frame(self.codec.encode_control(message))
+        self.bytes_out += len(frame)
+        self.writer.write(frame)
+
+    def send(self, text):
+        """Queue a chat line or /command; False if the queue is full or closed"""
+        if self.closed or len(self.pending) >= self.max_pending:
+            return False
+        command, _, arg = text.partition(" ")
+        if command == "/join" and arg.strip():
+            self.room = arg.strip().lstrip("#")
+        elif command == "/leave":
+            self.room = DEFAULT_ROOM
+        self.pending.append((False, text))
+        self.idle.clear()
+        self.wakeup.set()
+        return True
+
+    def join(self, room):
+        return self.send(f"/join {room}")
+
+    def direct(self, username, text):
+        return self.send(f"/msg {username} {text}")
+
+    async def drain(self):
+        """Wait until everything sent so far has been written"""
+        await self.idle.wait()
+
+    async def flush(self):
+        """Writer task: one transport write for everything queued"""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            await self.connected.wait()
+            writer, frames = self.writer, []
+            while self.pending:
+                is_control, message = self.pending.popleft()
+                payload = self.codec.encode_control(message) if is_control else self.codec.encode_text(message)
+                frames.append(encode_frame(payload))
+            if frames:
+                data = b"".join(frames)
+                self.bytes_out += len(data)
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                except CONNECTION_ERRORS:
+                    pass  # The reader notices and reconnects; these lines are lost
+            if not self.pending:
+                self.idle.set()
+
+    async def receive(self):
+        """Reader task: turn frames into events, reconnecting when dropped"""
+        try:
+            while not self.closed:
+                try:
+                    payload = await read_frame(self.reader)
+                    if payload is not None:
+                        self.bytes_in += len(payload) + HEADER_SIZE
+                        event = self.decode_event(payload)
+                except CONNECTION_ERRORS:
+                    payload = None
+                if payload is None:
+                    if self.closed or not await self.reconnect():
+                        break
+                    continue
+                if event is not None:
+                    await self.events.put(event)
+        finally:
+            self.shut()
+
+    def decode(self, payload):
+        """(is_control, message) for a payload; FrameError if it is undecodable.
+
+        After a bad tagged frame the stream cannot be trusted (a shared
+        zlib context is out of step), so the connection must be replaced.
+        """
+        try:
+            return self.codec.decode(payload)
+        except ValueError as e:
+            if not self.codec.tagged:
+                try:
+                    return False, payload.decode("utf-8")  # Chat text that looked like JSON
+                except ValueError:
+                    pass
+            raise FrameError(f"Undecodable frame: {e}")
+
+    def decode_event(self, payload):
+        """The event for a received payload, or None if handled here"""
+        is_control, content = self.decode(payload)
+        if not is_control:
+            return {"type": "chat", "message": content}
+        if not isinstance(content, dict):
+            return None
+        if content.get("type") == "ping":
+            if self.codec.tagged:  # Plain clients cannot send control frames now
+                self.send_control(PONG)
+            return None
+        if content.get("type") == "mailbox" and self.codec.tagged:
+            # Received: the server may delete it (plain clients are acked for)
+            self.send_control(mailbox_ack(content.get("up_to")))
+        if content.get("type") == "reconnect":
+            self.reconnect_after = content.get("retry_after")
+        return content
+
+    def send_control(self, message):
+        """Queue a control frame ahead of chat lines"""
+        self.pending.appendleft((True, message))
+        self.idle.clear()
+        self.wakeup.set()
+
+    def backoff_delay(self, attempt):
+        """Full jitter: spreads a crowd of clients over the whole interval"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def reconnect(self):
+        """Resume on a new connection; False once that is hopeless"""
+        self.connected.clear()
+        self.close_transport()
+        hint, self.reconnect_after = self.reconnect_after, None
+        if hint is None:
+            await self.events.put({"type": "disconnected", "message": "⚠️ Connection lost, reconnecting..."})
+        for attempt in range(self.reconnect_attempts):
+            if not self.token:
+                return False
+            if attempt == 0 and isinstance(hint, (int, float)):
+                await asyncio.sleep(hint)  # Server-chosen, randomized per client
+            else:
+                await asyncio.sleep(self.backoff_delay(attempt))
+            if self.closed:
+                return False
+            try:
+                await self.connect()
+                response = await self.resume(self.token)
+            except AuthError as e:
+                await self.events.put({"type": "error", "message": str(e)})
+                return False
+            except CONNECTION_ERRORS:
+                self.close_transport()
+                continue
+            if self.room != DEFAULT_ROOM:
+                self.pending.appendleft((False, f"/join {self.room}"))
+                self.idle.clear()
+            self.wakeup.set()
+            await self.events.put({"type": "reconnected", "message": f"🔄 {response.get('message')}"})
+            return True
+        return False
+
+    def close_transport(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def shut(self):
+        """Mark the client closed and wake anyone iterating over events"""
+        self.closed = True
+        self.connected.clear()
+        self.close_transport()
+        try:
+            self.events.put_nowait(None)
+        except asyncio.QueueFull:
+            pass  # A consumer will reach the end after draining the queue
+
+    async def close(self, leave=True):
+        """Leave the chat (optionally), flush what is queued and disconnect"""
+        if self.closed:
+            return
+        if leave and self.connected.is_set():
+            self.send(LEAVE_COMMAND)
+            try:
+                await asyncio.wait_for(self.drain(), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.shut()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self.events.empty():
+            raise StopAsyncIteration
+        event = await self.events.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
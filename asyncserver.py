@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from authserver import AuthChatServer
+from outbound import AsyncOutboundQueue
+from protocol import FrameError, read_frame
+from rooms import DEFAULT_ROOM
+from search import parse_query
+
+logger = logging.getLogger("chat.server")
+
+class AsyncAuthChatServer(AuthChatServer):
+    """Event-loop variant of AuthChatServer.
+
+    Runs authentication, chat reads and broadcast on a single asyncio loop
+    using streams instead of one thread per socket. Speaks exactly the same
+    wire protocol as the threaded server, so authclient.py works unchanged.
+    """
+
+    def __init__(self, host="127.0.0.1", port=5555, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.loop = None
+        self.server = None
+        # Blocking DB work runs off the event loop; DatabaseHandler hands
+        # each worker thread its own session, so the pool can be as wide
+        # as the DB connection pool
+        self.db_executor = ThreadPoolExecutor(
+            max_workers=self.db.pool_size,
+            thread_name_prefix="db"
+        )
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call (DB, bcrypt) without stalling the event loop"""
+        return await self.loop.run_in_executor(self.db_executor, func, *args)
+
+    def create_outbound_queue(self, writer):
+        """Attach a bounded outbound queue drained by its own writer task"""
+        queue = AsyncOutboundQueue(writer, self.queue_size, self.slow_consumer_policy, self.coalesce)
+        self.connections.get(writer).outbound = queue
+        return queue
+
+    def drop_client(self, writer):
+        """Abort the transport; the reader coroutine does the cleanup"""
+        writer.transport.abort()
+
+    def handle_backplane_event(self, event):
+        """Backplane events arrive on its reader thread; apply them on the loop"""
+        try:
+            self.loop.call_soon_threadsafe(super().handle_backplane_event, event)
+        except RuntimeError:
+            pass  # Loop already closed during shutdown
+
+    def call_later(self, delay, func, *args):
+        """Timers run on the loop, like everything else touching connections"""
+        self.loop.call_later(delay, func, *args)
+
+    def defer(self, writer, coroutine):
+        """Finish a reply that needs the DB before the client's next line is read.
+
+        Replies then go out in the order of the lines that asked for them,
+        as on the threaded server, while the query itself runs off the loop.
+        """
+        state = self.connections.get(writer)
+        if state is None:
+            coroutine.close()
+            return
+        if state.deferred is None:
+            state.deferred = []
+        state.deferred.append(coroutine)
+
+    async def run_deferred(self, state):
+        while state.deferred:
+            await state.deferred.pop(0)
+
+    def replay_history(self, writer, room):
+        """Hold everything else for the client until the room's history is sent"""
+        state = self.connections.get(writer)
+        if state is not None and state.held is None:
+            state.held = []
+        self.defer(writer, self.replay_history_held(writer, room))
+
+    async def replay_history_held(self, writer, room):
+        history = []
+        try:
+            history = await self.run_blocking(self.history_messages, room)
+        finally:
+            self.release_held(writer, history)
+
+    def release_held(self, writer, first=()):
+        """Send these messages, then the frames held back for them"""
+        state = self.connections.get(writer)
+        if state is None:
+            return
+        held, state.held = state.held or (), None
+        for message in first:
+            self.send_json(writer, message)
+        for frame in held:
+            self.enqueue(state, frame)
+
+    def handle_search(self, writer, arg):
+        """Searches query the database, so run them off the loop"""
+        try:
+            query = parse_query(arg)
+        except ValueError as e:
+            self.send_error(writer, str(e))
+            return
+        self.defer(writer, self.search_async(writer, arg, query))
+
+    async def search_async(self, writer, arg, query):
+        self.send_json(writer, await self.run_blocking(self.search_message, arg, query))
+
+    def leave_mail(self, writer, username, target, text):
+        """Checking that the recipient exists may query the DB: do it off the loop"""
+        self.defer(writer, self.leave_mail_async(writer, username, target, text))
+
+    async def leave_mail_async(self, writer, username, target, text):
+        exists = await self.run_blocking(self.db.user_exists, target)
+        self.store_mail(writer, username, target, text, exists)
+
+    async def deliver_mail_async(self, writer, username):
+        rows = await self.run_blocking(self.mailbox.fetch, username)
+        self.send_mail(writer, username, rows)
+
+    async def replay_history_async(self, writer, room):
+        for history in await self.run_blocking(self.history_messages, room):
+            self.send_json(writer, history)
+
+    async def process_auth_request_async(self, auth_data, ip=None):
+        """Event-loop version of process_auth_request.
+
+        The concurrency cap is checked on the loop, so a reconnect wave is
+        answered with a busy reply instead of piling up in the executor.
+        """
+        request_type = auth_data.get("type")
+        if request_type == "resume":
+            # Just an HMAC check, cheap enough to run on the loop
+            return self.resume_session(auth_data)
+        if request_type not in self.AUTH_RESPONSE_TYPES:
+            return {"type": "error", "message": "Unknown request type"}, None
+
+        limited = self.auth_rate_limited(auth_data, ip)
+        if limited is not None:
+            return limited, None
+        if not self.auth_slots.acquire(blocking=False):
+            return self.auth_busy_response(request_type), None
+        try:
+            return await self.run_blocking(self.run_auth_request, auth_data)
+        finally:
+            self.auth_slots.release()
+
+    async def handle_authentication(self, reader, writer, ip=None):
+        """Handle user authentication process"""
+        try:
+            self.send_json(writer, self.auth_required_message())
+
+            while self.running:
+                data = await read_frame(reader)
+                if data is None:
+                    return None
+                self.received(writer, data)
+
+                auth_data = self.decode_auth_payload(writer, data)
+                if auth_data is None:
+                    continue
+
+                response, username = await self.process_auth_request_async(auth_data, ip)
+                self.count_auth(auth_data, username)
+                self.send_json(writer, response)
+
+                if username:
+                    return username
+
+        except (ConnectionError, FrameError, asyncio.CancelledError):
+            return None
+        except Exception as e:
+            logger.error(f"❌ Authentication error: {e}")
+            return None
+
+    async def handle_client(self, reader, writer):
+        """Handle authenticated client messages"""
+        addr = writer.get_extra_info("peername")
+        ip = addr[0] if addr else None
+        state = self.connections.add(writer, addr)
+        self.create_outbound_queue(writer)
+        self.watch_connection(writer, writer.get_extra_info("socket"))
+        logger.info(f"🔌 New connection from {addr}")
+        metrics.CONNECTIONS.inc()
+        tls_object = writer.get_extra_info("ssl_object")
+        if tls_object is not None:
+            self.count_tls_handshake(tls_object)
+
+        username = await self.handle_authentication(reader, writer, ip)
+
+        if username is None:
+            logger.info(f"❌ Authentication failed for {addr}")
+            self.close_outbound_queue(writer)
+            self.connections.remove(writer)
+            writer.close()
+            return
+
+        self.send_json(writer, self.auth_success_message(username))
+
+        try:
+            await self.replay_history_async(writer, DEFAULT_ROOM)
+            self.enter_chat(writer, username)
+            logger.info(f"✅ {username} authenticated and joined from {addr}")
+            await self.deliver_mail_async(writer, username)
+
+            while self.running:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                self.received(writer, message)
+
+                is_control, decoded_message = self.codec_for(writer).decode(message, sniff_json=False)
+                if is_control:
+                    if isinstance(decoded_message, dict):
+                        self.handle_control(writer, decoded_message)
+                    continue
+
+                if not self.process_chat_message(writer, username, decoded_message, ip):
+                    break
+                if state.deferred:
+                    await self.run_deferred(state)
+
+        except (ConnectionError, FrameError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"❌ Error handling client {addr}: {e}")
+        finally:
+            for coroutine in state.deferred or ():
+                coroutine.close()  # Replies nobody will read
+            self.remove_client(writer)
+            writer.close()
+
+    async def run_backplane_heartbeats_async(self):
+        while self.running:
+            await asyncio.sleep(self.backplane_heartbeat)
+            self.backplane_tick()
+
+    async def run_heartbeats_async(self):
+        """Heartbeat ticks run on the loop, so pings and drops need no locking"""
+        while self.running:
+            await asyncio.sleep(self.heartbeats.tick)
+            self.check_heartbeats()
+
+    def request_stop(self):
+        """Wake serve() so it drains (safe from any thread)"""
+        try:
+            self.loop.call_soon_threadsafe(self.stop_requested.set)
+        except RuntimeError:
+            pass  # Loop already closed
+
+    async def drain_async(self):
+        """Event-loop version of drain: hint, flush queues, wait for writers"""
+        self.draining = True
+        states = self.connections.snapshot()
+        for state in states:
+            self.send_json(state.conn, self.reconnect_message())
+            if state.outbound is not None:
+                state.outbound.close(flush=True)
+        tasks = [state.outbound.task for state in states if state.outbound is not None]
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.drain_timeout)
+        for state in states:
+            state.conn.close()
+        logger.info(f"🚰 Drained {len(states)} connections")
+
+    async def serve(self):
+        """Accept connections on the event loop until asked to stop, then drain"""
+        self.loop = asyncio.get_running_loop()
+        self.stop_requested = asyncio.Event()
+        listen_socket = self.open_listener()
+        # With TLS the loop runs each handshake (non-blocking) before handle_client
+        self.server = await asyncio.start_server(
+            self.handle_client, sock=listen_socket, ssl=self.tls_context,
+            ssl_handshake_timeout=self.tls_handshake_timeout if self.tls_context else None
+        )
+        self.running = True
+        self.start_backplane()
+        self.start_metrics()
+        self.offer_listener(listen_socket)
+        if self.heartbeats is not None:
+            self.loop.create_task(self.run_heartbeats_async())
+        if self.backplane is not None and self.backplane_heartbeat:
+            self.loop.create_task(self.run_backplane_heartbeats_async())
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            if signal.getsignal(signum) is signal.SIG_IGN:
+                continue  # Supervisor workers leave Ctrl+C to the supervisor
+            try:
+                self.loop.add_signal_handler(signum, self.stop_requested.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # No signal handlers here: KeyboardInterrupt still works
+
+        logger.info(f"🚀 Auth Chat Server (asyncio) started on {self.host}:{self.port}")
+        if self.tls_context is not None:
+            logger.info("🔒 TLS enabled")
+        logger.info("🔐 Authentication required for all users")
+        logger.info("=" * 50)
+
+        await self.stop_requested.wait()
+        self.running = False
+        self.server.close()  # Stop accepting; connections stay open
+        if self.drain_timeout:
+            await self.drain_async()
+
+    def start_server(self):
+        """Start the event-loop chat server; False if it failed"""
+        try:
+            asyncio.run(self.serve())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"❌ Server error: {e}")
+            return False
+        finally:
+            self.stop_server()
+        return True
+
+    def stop_server(self):
+        """Stop the server and close all connections"""
+        if self.loop is not None and self.loop.is_running() and self.server is not None:
+            # Called from another thread: let the loop drain and tear itself down
+            self.request_stop()
+            return
+
+        logger.info("\n🛑 Shutting down server...")
+        self.running = False
+        if self.handoff is not None:
+            self.handoff.close()
+
+        for state in self.connections.snapshot():
+            self.close_outbound_queue(state.conn)
+            try:
+                state.conn.close()
+            except Exception:
+                pass
+
+        self.db_executor.shutdown(wait=False)
+        self.history.close()
+        self.presence.close()
+        self.mail_unconfirmed_directs()
+        self.mailbox.close()
+        if self.backplane is not None:
+            self.backplane.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        logger.info(f"📊 Credential cache: {self.db.cache.stats()}")
+        self.db.close()
+        logger.info("✅ Server stopped successfully")
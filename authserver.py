@@ -1,188 +1,1157 @@
+import argparse
+import logging
+import math
+import random
+import signal
 import socket
+import sys
 import threading
-import json
-from database import DatabaseHandler
+import time
+import uuid
+from datetime import datetime
+import metrics
+from backplane import create_backplane
+from cache import CredentialCache
+from connections import ConnectionRegistry
+from database import DEFAULT_DB_URL, MAX_USERNAME_CHARS, DatabaseHandler
+from handoff import ListenerHandoff, take_over
+from hashing import POOL_KINDS, PasswordHasher
+from heartbeat import Heartbeats, enable_keepalive
+from history import MessageStore
+from logs import LOG_LEVELS, setup_logging, stop_logging
+from offline import Mailbox
+from outbound import DEFAULT_QUEUE_SIZE, DROP_OLDEST, SLOW_CONSUMER_POLICIES, CoalesceWindow, OutboundQueue
+from presence import PresenceService
+from ratelimit import RateLimit
+from search import PAGE_SIZE, MessageSearch, parse_query, snippet, tokenize
+from protocol import (
+    COMPRESS_THRESHOLD, HEADER_SIZE, JSON_ENCODING, LEAVE_COMMAND, MAILBOX_ACK, MAX_FRAME_SIZE, MAX_LINE_CHARS, PING,
+    PLAIN_CODEC, PONG, ZLIB_COMPRESSION,
+    Codec, Compressible, FramedSocket, encode_frame, supported_encodings
+)
+from rooms import DEFAULT_ROOM, ROOM_NAME, RoomManager
+from tls import TLSSocket, server_context
+from tokens import SessionTokens
+
+logger = logging.getLogger("chat.server")
+
+# Stored lines (history, mail) per reply frame, and their characters per
+# frame: lines are at most MAX_LINE_CHARS, and even JSON-escaped (up to
+# 12 bytes per character) a full frame stays below MAX_FRAME_SIZE.
+# check_frame_limits() verifies that at startup.
+FRAME_ROWS = 100
+FRAME_CHARS = 64000
+
+def frame_batches(rows, key="content", copies=1):
+    """Split rows into runs that each fit in one reply frame.
+
+    copies is how many times a frame carries each row's text.
+    """
+    batch, size = [], 0
+    for row in rows:
+        length = len(row[key]) * copies
+        if batch and (len(batch) == FRAME_ROWS or size + length > FRAME_CHARS):
+            yield batch
+            batch, size = [], 0
+        batch.append(row)
+        size += length
+    if batch:
+        yield batch
+
+def check_frame_limits():
+    """Raise RuntimeError unless the largest history, mailbox and search
+    replies fit in one frame with every codec this process can speak"""
+    widest = "😀"  # JSON escapes it as 12 bytes, msgpack stores 4
+    name = widest * MAX_USERNAME_CHARS
+    created_at = datetime(2000, 12, 31, 23, 59, 59, 999999)
+
+    def rows(count, length):
+        return [
+            {"id": 2 ** 62 + index, "room": "r" * 32, "username": name, "sender": name,
+             "content": widest * length, "created_at": created_at}
+            for index in range(count)
+        ]
+
+    many, long = rows(10 * FRAME_ROWS, FRAME_CHARS // FRAME_ROWS), rows(10, MAX_LINE_CHARS)
+    messages = []
+    for sample in (many, long):
+        messages += AuthChatServer.history_frames("r" * 32, sample)
+        messages += [AuthChatServer.mailbox_message(batch) for batch in frame_batches(sample, copies=2)]
+    for arg in ("世" * MAX_LINE_CHARS, widest * MAX_LINE_CHARS):
+        query = {"terms": tokenize(arg) or ["x"]}
+        messages.append(AuthChatServer.search_reply(arg, query, long[:PAGE_SIZE], 2 ** 62))
+
+    codecs = [PLAIN_CODEC] + [
+        Codec(encoding, compression, threshold=0)
+        for encoding in supported_encodings() for compression in (None, ZLIB_COMPRESSION)
+    ]
+    for codec in codecs:
+        for message in messages:
+            payload = codec.encode_control(message)
+            if codec.wants_compression(payload):
+                payload = codec.compress(payload)
+            if len(payload) > MAX_FRAME_SIZE:
+                raise RuntimeError(
+                    f"A {message['type']} reply can reach {len(payload)} bytes, over MAX_FRAME_SIZE"
+                )
+
+def create_listen_socket(host, port, backlog=1024, reuse_port=False):
+    """Bind a listening TCP socket.
+
+    reuse_port lets several worker processes bind the same port
+    (SO_REUSEPORT); the kernel then spreads new connections across them.
+    The explicit IPPROTO_TCP lets asyncio set TCP_NODELAY on accepted
+    connections, as it does for sockets it creates itself.
+    """
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise OSError("SO_REUSEPORT is not supported on this platform")
+        listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listen_socket.bind((host, port))
+    listen_socket.listen(backlog)
+    return listen_socket
 
 class AuthChatServer:
-    def __init__(self, host="127.0.0.1", port=5555):
+    def __init__(self, host="127.0.0.1", port=5555,
+                 queue_size=DEFAULT_QUEUE_SIZE, slow_consumer_policy=DROP_OLDEST,
+                 max_concurrent_auth=32, hasher=None, db_url=DEFAULT_DB_URL, db_pool_size=10,
+                 credential_cache=None, session_tokens=None,
+                 history_size=50, history_flush_interval=0.2, backplane=None,
+                 backlog=1024, reuse_port=False, metrics_host="127.0.0.1", metrics_port=None,
+                 compress_threshold=COMPRESS_THRESHOLD, coalesce_ms=2.0, last_seen_flush_interval=30.0,
+                 message_rate=10.0, message_burst=20, auth_rate=0.2, auth_burst=5,
+                 ip_limit_multiplier=5.0, rate_limit_keys=100000,
+                 ping_interval=30.0, idle_timeout=90.0, keepalive=(60, 10, 5),
+                 drain_timeout=5.0, reconnect_spread=10.0, handoff_path=None, take_over_path=None,
+                 tls_context=None, tls_handshake_timeout=10.0, mailbox_size=500, mailbox_days=30.0,
+                 backplane_heartbeat=10.0):
         self.host = host
         self.port = port
-        self.clients = []
-        self.authenticated_clients = {}  # Map socket to username
-        self.db = DatabaseHandler()
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        # Graceful shutdown: clients are told to come back after a random
+        # delay of up to reconnect_spread seconds and their queues get up to
+        # drain_timeout seconds to flush (0: close everything at once)
+        self.drain_timeout = drain_timeout
+        self.reconnect_spread = reconnect_spread
+        self.draining = False
+        # Zero-downtime restart: offer our listening socket at handoff_path,
+        # and/or start from the one offered at take_over_path
+        self.handoff = ListenerHandoff(handoff_path) if handoff_path else None
+        self.take_over_path = take_over_path
+        # Optional TLS (an ssl.SSLContext); handshakes run on the client's
+        # own thread or task, never on the accept loop
+        self.tls_context = tls_context
+        self.tls_handshake_timeout = tls_handshake_timeout
+        # Socket -> ClientState (username, outbound queue, codec)
+        self.connections = ConnectionRegistry()
+        self.rooms = RoomManager()  # Room membership
+        self.compress_threshold = compress_threshold  # 0 turns compression off
+        # Shared by every outbound writer; adjustable at runtime (see settings)
+        self.coalesce = CoalesceWindow(coalesce_ms / 1000)
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        # Login/register attempts in flight; extra attempts are turned away
+        # instead of piling up behind bcrypt during a reconnect wave
+        self.auth_slots = threading.BoundedSemaphore(max_concurrent_auth)
+        # Token buckets per username and per IP; chat lines and auth
+        # attempts have separate budgets (rate 0 disables a budget)
+        self.message_limit = RateLimit(message_rate, message_burst, ip_limit_multiplier, rate_limit_keys)
+        self.auth_limit = RateLimit(auth_rate, auth_burst, ip_limit_multiplier, rate_limit_keys)
+        # Ping quiet connections and reap dead ones (ping_interval 0: off);
+        # keepalive is (idle, interval, count) for TCP keepalive, or None
+        self.heartbeats = (
+            Heartbeats(ping_interval, idle_timeout, tick=min(1.0, ping_interval / 4))
+            if ping_interval else None
+        )
+        self.keepalive = keepalive
+        self.tokens = session_tokens or SessionTokens()
+        # Other processes on the same database cache credentials too: tell
+        # them (over the backplane) when a user is created or changed here
+        self.db = DatabaseHandler(
+            db_url, hasher=hasher, pool_size=db_pool_size, cache=credential_cache,
+            on_user_changed=self.publish_user_changed
+        )
         self.server_socket = None
         self.running = False
         
-        print("🚀 Auth Chat Server initialized")
-        print(f"📊 Database stats: {self.db.get_user_stats()}")
+        # Relays broadcasts/presence to other server processes, if any.
+        # Nodes publish a heartbeat every backplane_heartbeat seconds; one
+        # missing MISSED_HEARTBEATS of them in a row is taken for dead
+        self.backplane = backplane
+        self.backplane_heartbeat = backplane_heartbeat
+        # Direct messages handed to other nodes: id -> (sender socket,
+        # sender, target, text), mailed unless a node confirms delivery
+        self.relayed_directs = {}
+        self.direct_lock = threading.Lock()
+        # Username -> connections here, who is online on other nodes, last seen
+        self.presence = PresenceService(self.db, flush_interval=last_seen_flush_interval)
+        
+        # /search: the database's FTS5 index, or an in-process one fed by history
+        self.search = MessageSearch(self.db)
+        self.history = MessageStore(
+            self.db, flush_interval=history_flush_interval, replay_size=history_size,
+            on_saved=self.search.add
+        )
+        
+        # Direct messages for users offline everywhere, delivered at login
+        self.mailbox = Mailbox(self.db, max_per_user=mailbox_size, retention_days=mailbox_days)
+        
+        # Prometheus endpoint on a local admin port (disabled by default)
+        self.metrics_server = (
+            metrics.MetricsServer(metrics_host, metrics_port, settings=self.runtime_settings())
+            if metrics_port else None
+        )
+        metrics.CONNECTED_CLIENTS.set_function(lambda: len(self.connections))
+        metrics.AUTHENTICATED_CLIENTS.set_function(self.connections.authenticated_count)
+        metrics.OUTBOUND_QUEUED.set_function(lambda: sum(self.queue_depths()))
+        metrics.OUTBOUND_MAX_DEPTH.set_function(lambda: max(self.queue_depths(), default=0))
+        
+        logger.info("🚀 Auth Chat Server initialized")
+        logger.info(f"📊 Database stats: {self.db.get_user_stats()}")
+
+    def broadcast(self, message, sender_socket=None, room=None, relay=True):
+        """Send message to a room's members, or every authenticated client.
 
-    def broadcast(self, message, sender_socket=None):
-        """Send message to all authenticated clients"""
-        message_bytes = message.encode('utf-8')
+        message is a chat line (str) or a control message (dict). With a
+        backplane it is also published so members connected to other server
+        processes get it; relay=False for relayed events.
+        """
+        started = time.perf_counter()
+        if room is None:
+            recipients = self.connections.authenticated_connections()
+        else:
+            recipients = self.rooms.members(room)
         
-        disconnected_clients = []
-        for client in self.clients:
-            if client != sender_socket and client in self.authenticated_clients:
-                try:
-                    client.send(message_bytes)
-                except:
-                    disconnected_clients.append(client)
+        self.send_shared(recipients, message, exclude=sender_socket)
+        
+        metrics.BROADCAST_SECONDS.observe(time.perf_counter() - started)
+        metrics.BROADCAST_RECIPIENTS.observe(len(recipients))
+        
+        if relay and self.backplane is not None:
+            self.backplane.publish({"kind": "broadcast", "room": room, "message": message})
+
+    def start_backplane(self):
+        """Connect to the backplane and ask peers who is online where"""
+        if self.backplane is None:
+            return
+        self.backplane.start(self.handle_backplane_event)
+        self.backplane.publish({"kind": "presence_sync"})
+        logger.info(f"🔀 Backplane connected as node {self.backplane.node_id}")
+
+    MISSED_HEARTBEATS = 3
+
+    def handle_backplane_event(self, event):
+        """Apply an event published by another server process"""
+        kind = event.get("kind")
+        origin = event.get("origin")
         
-        # Clean up disconnected clients
-        for client in disconnected_clients:
-            self.remove_client(client)
+        if kind == "broadcast":
+            self.broadcast(event.get("message", ""), room=event.get("room"), relay=False)
+        elif kind == "direct":
+            connections = self.presence.connections(event.get("target"))
+            self.send_shared(connections, event.get("message", ""))
+            if connections and event.get("id"):
+                self.backplane.publish({"kind": "direct_ack", "id": event["id"]})
+        elif kind == "direct_ack":
+            self.direct_confirmed(event.get("id"))
+        elif kind == "presence":
+            self.presence.update_remote(origin, event.get("username"), event.get("online"))
+        elif kind == "heartbeat":
+            if not self.presence.touch_remote(origin):
+                # Forgotten (or never heard from): ask every node for snapshots
+                self.backplane.publish({"kind": "presence_sync"})
+        elif kind == "node_down":
+            count = self.presence.remove_remote(origin)
+            logger.info(f"🔀 Node {origin} left the backplane, forgetting its {count} users")
+        elif kind == "presence_sync":
+            # A node (re)joined: tell it who is connected here
+            if origin is not None:  # Not our backplane's own resync request
+                self.presence.touch_remote(origin)
+            self.backplane.publish({
+                "kind": "presence_snapshot",
+                "usernames": self.presence.local_usernames()
+            })
+        elif kind == "presence_snapshot":
+            self.presence.set_remote(origin, event.get("usernames", ()))
+        elif kind == "user_changed":
+            # Registered or changed on another node: our cached (possibly
+            # negative) entry is stale
+            self.db.cache.invalidate(event.get("username"))
+
+    def runtime_settings(self):
+        """Values the admin endpoint may change while the server runs"""
+        return {
+            "coalesce_ms": (lambda: self.coalesce.seconds * 1000, self.set_coalesce_ms)
+        }
+
+    def set_coalesce_ms(self, value):
+        window = float(value)
+        if not 0 <= window <= 1000:
+            raise ValueError("must be between 0 and 1000 ms")
+        self.coalesce.seconds = window / 1000
+        logger.info(f"⏱️ Coalescing window set to {window:g} ms")
+
+    def start_metrics(self):
+        """Serve the metrics endpoint, if one was configured"""
+        if self.metrics_server is None:
+            return
+        self.metrics_server.start()
+        logger.info(f"📈 Metrics at http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+
+    def backplane_tick(self):
+        """Tell other nodes we are alive; forget the ones that went quiet"""
+        self.backplane.publish({"kind": "heartbeat"})
+        for node in self.presence.expire_remote(self.MISSED_HEARTBEATS * self.backplane_heartbeat):
+            logger.warning(f"⚠️ Node {node} stopped sending heartbeats, forgetting its users")
+
+    def run_backplane_heartbeats(self):
+        """Backplane heartbeat thread of the threaded server"""
+        while self.running:
+            time.sleep(self.backplane_heartbeat)
+            self.backplane_tick()
+
+    def call_later(self, delay, func, *args):
+        """Run func(*args) after delay seconds on a timer thread"""
+        timer = threading.Timer(delay, func, args)
+        timer.daemon = True
+        timer.start()
+
+    def publish_user_changed(self, username):
+        """Tell other nodes to drop their cached credentials for a user"""
+        if self.backplane is not None:
+            self.backplane.publish({"kind": "user_changed", "username": username})
+
+    def publish_presence(self, username, online):
+        """Tell other nodes a user came online here or left the last device"""
+        if self.backplane is not None:
+            self.backplane.publish({"kind": "presence", "username": username, "online": online})
+
+    def create_outbound_queue(self, client_socket):
+        """Attach a bounded outbound queue with its own writer to a client"""
+        queue = OutboundQueue(client_socket, self.queue_size, self.slow_consumer_policy, self.coalesce)
+        self.connections.get(client_socket).outbound = queue
+        return queue
+
+    def queue_depths(self):
+        return [state.outbound.depth() for state in self.connections.snapshot() if state.outbound is not None]
+
+    def send_frame(self, client_socket, frame):
+        """Queue an encoded frame for a client without blocking the caller"""
+        state = self.connections.get(client_socket)
+        if state is not None:
+            self.enqueue(state, frame)
+
+    def enqueue(self, state, frame):
+        if state.held is not None:
+            state.held.append(frame)  # Goes out once the reply ahead of it is sent
+            return
+        queue = state.outbound
+        if queue is None:
+            return
+        if not queue.put(frame) and not self.draining:
+            # Slow consumer under the disconnect policy
+            self.drop_client(state.conn)
+
+    def send_shared(self, connections, message, exclude=None):
+        """Queue one chat line (str) or control message (dict) for many clients.
+
+        It is encoded once per encoding in use, so every recipient queue
+        with the same kind of codec shares the same bytes object.
+        """
+        frames = {}
+        for client in connections:
+            if client is exclude:
+                continue
+            state = self.connections.get(client)
+            if state is None:
+                continue
+            codec = state.codec
+            frame = frames.get(codec.encoding)
+            if frame is None:
+                if isinstance(message, str):
+                    payload = codec.encode_text(message)
+                else:
+                    payload = codec.encode_control(message)
+                frame = frames[codec.encoding] = encode_frame(payload)
+            self.enqueue(state, frame)
+
+    def send_json(self, client_socket, message):
+        """Queue a control message for a client, compressed if negotiated"""
+        codec = self.codec_for(client_socket)
+        payload = codec.encode_control(message)
+        if codec.wants_compression(payload):
+            self.send_frame(client_socket, Compressible(payload))
+        else:
+            self.send_frame(client_socket, encode_frame(payload))
+
+    def codec_for(self, client_socket):
+        state = self.connections.get(client_socket)
+        return state.codec if state is not None else PLAIN_CODEC
+
+    def negotiate(self, client_socket, hello):
+        """Answer a client's hello and switch the connection to a tagged codec.
+
+        Picks the first encoding the client lists that we support, plus
+        zlib when both sides want it. The ack itself still goes out plain;
+        every frame after it, in both directions, uses the new codec.
+        """
+        offered = hello.get("encodings")
+        offered = offered if isinstance(offered, list) else []
+        encoding = next((name for name in offered if name in supported_encodings()), JSON_ENCODING)
+        compression = None
+        if self.compress_threshold and ZLIB_COMPRESSION in (hello.get("compression") or ()):
+            compression = ZLIB_COMPRESSION
+        
+        self.send_json(client_socket, {"type": "hello_ack", "encoding": encoding, "compression": compression})
+        codec = Codec(encoding, compression, self.compress_threshold)
+        state = self.connections.get(client_socket)
+        if state is None:
+            return
+        features = hello.get("features")
+        state.acks_mail = isinstance(features, list) and MAILBOX_ACK in features
+        state.codec = codec
+        if state.outbound is not None:
+            state.outbound.codec = codec
+
+    def drop_client(self, client_socket):
+        """Force a connection closed; its handler thread does the cleanup"""
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def watch_connection(self, client_socket, sock):
+        """Start liveness checks for a new connection"""
+        if self.keepalive:
+            enable_keepalive(sock, *self.keepalive)
+        if self.heartbeats is not None:
+            self.heartbeats.add(client_socket)
+
+    def received(self, client_socket, data):
+        """Account for one frame read from a client"""
+        metrics.BYTES_IN.inc(len(data) + HEADER_SIZE)
+        if self.heartbeats is not None:
+            self.heartbeats.touch(client_socket)
+
+    def check_heartbeats(self):
+        """One timer wheel tick: ping quiet clients, drop silent ones"""
+        to_ping, to_reap = self.heartbeats.due()
+        for client in to_ping:
+            self.send_json(client, PING)
+        for client in to_reap:
+            state = self.connections.get(client)
+            logger.info(f"💤 Dropping idle connection of {(state and state.username) or 'unauthenticated client'}")
+            metrics.IDLE_REAPED.inc()
+            self.drop_client(client)
+
+    def run_heartbeats(self):
+        """Heartbeat thread of the threaded server (one for all clients)"""
+        while self.running:
+            time.sleep(self.heartbeats.tick)
+            self.check_heartbeats()
+
+    def handle_control(self, client_socket, control):
+        """Control messages from an authenticated client"""
+        if control.get("type") == "ping":
+            self.send_json(client_socket, PONG)
+        elif control.get("type") == "mailbox_ack":
+            state = self.connections.get(client_socket)
+            up_to = control.get("up_to")
+            if state is not None and state.username and isinstance(up_to, int):
+                self.mailbox.ack(state.username, up_to)
+        # pong: receiving it already counted as activity
+
+    def close_outbound_queue(self, client_socket):
+        if self.heartbeats is not None:
+            self.heartbeats.remove(client_socket)
+        state = self.connections.get(client_socket)
+        if state is None:
+            return
+        queue, state.outbound = state.outbound, None
+        if queue is not None:
+            # While draining, whatever is queued (the reconnect hint) still goes out
+            queue.close(flush=self.draining)
 
     def remove_client(self, client_socket):
         """Remove client and notify others"""
-        if client_socket in self.clients:
-            username = self.authenticated_clients.get(client_socket, "Unknown")
+        self.close_outbound_queue(client_socket)
+        state = self.connections.remove(client_socket)
+        if state is not None:
+            username = state.username
+            room = self.rooms.remove(client_socket)
             
-            self.clients.remove(client_socket)
-            if client_socket in self.authenticated_clients:
-                del self.authenticated_clients[client_socket]
-            
-            if username != "Unknown":
-                leave_message = f"🚪 {username} left the chat"
-                self.broadcast(leave_message)
-                print(f"❌ {username} disconnected")
+            if username is not None:
+                if self.presence.disconnect(client_socket, username):
+                    self.publish_presence(username, False)
+                room = room or DEFAULT_ROOM
+                self.broadcast(
+                    self.presence_delta(username, room, False, f"🚪 {username} left the chat"), room=room
+                )
+                logger.info(f"❌ {username} disconnected")
+
+    def enter_chat(self, client_socket, username):
+        """Admit a freshly authenticated client into the default room"""
+        self.connections.authenticate(client_socket, username)
+        if self.heartbeats is not None and not self.codec_for(client_socket).tagged:
+            # Plain-codec clients cannot send control frames after auth,
+            # so they cannot pong; TCP keepalive covers them
+            self.heartbeats.exempt(client_socket)
+        self.rooms.join(client_socket, username, DEFAULT_ROOM)
+        if self.presence.connect(client_socket, username):
+            self.publish_presence(username, True)
+        
+        # Notify others
+        self.broadcast(
+            self.presence_delta(username, DEFAULT_ROOM, True, f"👋 {username} joined the chat"),
+            client_socket, DEFAULT_ROOM
+        )
+
+    @staticmethod
+    def presence_delta(username, room, joined, text):
+        """One join/leave event for a room's members.
+
+        Members get only what changed, never the full member list; the
+        human-readable text keeps older clients (which print "message")
+        working unchanged.
+        """
+        return {
+            "type": "presence",
+            "event": "join" if joined else "leave",
+            "username": username,
+            "room": room,
+            "message": text
+        }
+
+    def process_chat_message(self, client_socket, username, text, ip=None):
+        """Route one chat line or command; returns False when the client leaves"""
+        if text.startswith(LEAVE_COMMAND):
+            return False
+        
+        if len(text) > MAX_LINE_CHARS:
+            self.send_error(client_socket, f"Message too long (max {MAX_LINE_CHARS} characters)")
+            return True
+        
+        retry_after, notify = self.message_limit.check(username, ip)
+        if retry_after:
+            # Dropped; only the first drop of a burst is reported
+            metrics.RATE_LIMITED.inc(kind="message")
+            if notify:
+                self.send_rate_limited(client_socket, retry_after)
+            return True
+        
+        if text.startswith("/"):
+            self.handle_command(client_socket, username, text)
+            return True
+        
+        # Regular chat message - add username prefix
+        metrics.MESSAGES.inc()
+        room = self.rooms.room_of(client_socket) or DEFAULT_ROOM
+        chat_message = f"{username}: {text}"
+        logger.debug("📩 [%s] %s", room, chat_message)
+        self.broadcast(chat_message, client_socket, room)
+        self.history.append(username, text, room)
+        return True
+
+    def handle_command(self, client_socket, username, text):
+        """Chat commands: /join, /leave, /rooms, /who, /msg, /search, /help"""
+        command, _, arg = text.partition(" ")
+        arg = arg.strip()
+        
+        if command == "/join":
+            if not ROOM_NAME.match(arg):
+                self.send_error(client_socket, "Usage: /join <room> (letters, digits, - and _, max 32)")
+                return
+            self.join_room(client_socket, username, arg)
+        elif command == "/leave":
+            self.join_room(client_socket, username, DEFAULT_ROOM)
+        elif command == "/rooms":
+            listing = ", ".join(
+                f"#{room} ({count})" for room, count in sorted(self.rooms.room_sizes().items())
+            )
+            self.send_info(client_socket, f"🏠 Rooms: {listing}")
+        elif command == "/who":
+            self.send_who(client_socket)
+        elif command == "/msg":
+            self.send_direct_message(client_socket, username, arg)
+        elif command == "/search":
+            self.handle_search(client_socket, arg)
+        elif command == "/help":
+            self.send_info(
+                client_socket,
+                "Commands: /join <room>, /leave, /rooms, /who, /msg <user> <text>, "
+                "/search <words> [from:<user>] [in:<room>]"
+            )
+        else:
+            self.send_error(client_socket, f"Unknown command {command}, try /help")
+
+    def join_room(self, client_socket, username, room):
+        """Move a client to another room, announcing it on both sides"""
+        previous = self.rooms.join(client_socket, username, room)
+        if previous == room:
+            self.send_info(client_socket, f"You are already in #{room}")
+            return
+        
+        if previous is not None:
+            self.broadcast(
+                self.presence_delta(username, previous, False, f"🚪 {username} left #{previous}"),
+                client_socket, previous
+            )
+        self.broadcast(
+            self.presence_delta(username, room, True, f"👋 {username} joined #{room}"),
+            client_socket, room
+        )
+        self.send_info(client_socket, f"🏠 You are now in #{room}")
+        self.replay_history(client_socket, room)
+
+    def send_direct_message(self, client_socket, username, arg):
+        """Deliver a private message to every connection of the target user"""
+        target, _, text = arg.partition(" ")
+        if not target or not text.strip():
+            self.send_error(client_socket, "Usage: /msg <user> <text>")
+            return
+        
+        message = f"💌 {username} → you: {text}"
+        connections = self.presence.connections(target)
+        if connections:
+            self.send_shared(connections, message)
+        elif self.presence.online_elsewhere(target):
+            self.relay_direct(client_socket, username, target, text, message)
+            return
+        else:
+            self.leave_mail(client_socket, username, target, text)
+            return
+        
+        self.send_info(client_socket, f"💌 you → {target}: {text}")
+
+    DIRECT_ACK_TIMEOUT = 2.0  # Seconds a relayed DM waits to be confirmed
+
+    def relay_direct(self, client_socket, username, target, text, message):
+        """Publish a DM for a user online on another node.
+
+        Presence of other nodes may be stale (a node crashed, or the user
+        just left), so unless a node confirms delivery within
+        DIRECT_ACK_TIMEOUT the message goes to the mailbox instead.
+        """
+        direct_id = uuid.uuid4().hex
+        with self.direct_lock:
+            self.relayed_directs[direct_id] = (client_socket, username, target, text)
+        self.backplane.publish({"kind": "direct", "id": direct_id, "target": target, "message": message})
+        self.call_later(self.DIRECT_ACK_TIMEOUT, self.direct_unconfirmed, direct_id)
+
+    def direct_confirmed(self, direct_id):
+        with self.direct_lock:
+            relayed = self.relayed_directs.pop(direct_id, None)
+        if relayed is not None:
+            client_socket, _, target, text = relayed
+            self.send_info(client_socket, f"💌 you → {target}: {text}")
+
+    def direct_unconfirmed(self, direct_id):
+        with self.direct_lock:
+            relayed = self.relayed_directs.pop(direct_id, None)
+        if relayed is not None:
+            client_socket, username, target, text = relayed
+            self.store_mail(client_socket, username, target, text, True)
+
+    def mail_unconfirmed_directs(self):
+        """On shutdown, mail every relayed DM still waiting for confirmation"""
+        with self.direct_lock:
+            waiting = list(self.relayed_directs)
+        for direct_id in waiting:
+            self.direct_unconfirmed(direct_id)
+
+    def leave_mail(self, client_socket, username, target, text):
+        """Keep a direct message for a user who is offline everywhere"""
+        self.store_mail(client_socket, username, target, text, self.db.user_exists(target))
+
+    def store_mail(self, client_socket, username, target, text, exists):
+        if not exists:
+            self.send_error(client_socket, f"{target} is not a registered user")
+            return
+        self.mailbox.append(target, username, text)
+        metrics.MAILBOX_STORED.inc()
+        self.send_info(client_socket, f"📪 you → {target} (offline, delivered at their next login): {text}")
+
+    def deliver_mail(self, client_socket, username):
+        """Send a user's waiting direct messages, read in one query"""
+        self.send_mail(client_socket, username, self.mailbox.fetch(username))
+
+    def send_mail(self, client_socket, username, rows):
+        """Queue mailbox frames; clients that cannot ack count as served"""
+        if not rows:
+            return
+        for batch in frame_batches(rows, copies=2):  # Listed and in the summary
+            self.send_json(client_socket, self.mailbox_message(batch))
+        metrics.MAILBOX_DELIVERED.inc(len(rows))
+        state = self.connections.get(client_socket)
+        if state is None or not state.acks_mail:
+            self.mailbox.ack(username, rows[-1]["id"])
+
+    @staticmethod
+    def mailbox_message(rows):
+        """One mailbox frame; the client acks it with mailbox_ack(up_to)"""
+        lines = "\n".join(
+            f"[{row['created_at']:%m-%d %H:%M}] 💌 {row['sender']} → you: {row['content'][:MAX_LINE_CHARS]}"
+            for row in rows
+        )
+        return {
+            "type": "mailbox",
+            "messages": [
+                {
+                    "id": row["id"],
+                    "username": row["sender"],
+                    "message": row["content"][:MAX_LINE_CHARS],
+                    "timestamp": row["created_at"].isoformat()
+                }
+                for row in rows
+            ],
+            "up_to": rows[-1]["id"],
+            "message": f"📬 While you were away:\n{lines}"
+        }
+
+    WHO_LIMIT = 200  # Names listed by /who; the count is always exact
+
+    def send_who(self, client_socket):
+        """List who is online on any node"""
+        users = self.presence.online_users()
+        shown = users[:self.WHO_LIMIT]
+        listing = ", ".join(shown)
+        if len(users) > len(shown):
+            listing += f" and {len(users) - len(shown)} more"
+        self.send_json(client_socket, {
+            "type": "who",
+            "count": len(users),
+            "users": shown,
+            "message": f"🟢 Online ({len(users)}): {listing}"
+        })
 
-    def handle_authentication(self, client_socket):
+    def handle_search(self, client_socket, arg):
+        try:
+            query = parse_query(arg)
+        except ValueError as e:
+            self.send_error(client_socket, str(e))
+            return
+        self.send_json(client_socket, self.search_message(arg, query))
+
+    def search_message(self, arg, query):
+        """Run a search and build its reply: one page, newest first"""
+        return self.search_reply(arg, query, *self.search.search(query))
+
+    @staticmethod
+    def search_reply(arg, query, rows, next_before):
+        lines = [
+            f"[{row['id']} #{row['room']} {row['created_at']:%m-%d %H:%M}] {row['username']}: {snippet(row['content'])}"
+            for row in rows
+        ]
+        text = f"🔎 {len(rows)} result(s) for '{' '.join(query['terms'])}'"
+        if lines:
+            text += ":\n" + "\n".join(lines)
+        if next_before is not None:
+            more = " ".join(word for word in arg.split() if not word.startswith("before:"))
+            text += f"\nMore: /search {more} before:{next_before}"
+        return {
+            "type": "search",
+            "results": [
+                {
+                    "id": row["id"],
+                    "room": row["room"],
+                    "username": row["username"],
+                    "message": snippet(row["content"]),
+                    "timestamp": row["created_at"].isoformat()
+                }
+                for row in rows
+            ],
+            "next_before": next_before,
+            "message": text
+        }
+
+    def replay_history(self, client_socket, room):
+        """Send a room's recent history to one client"""
+        for history in self.history_messages(room):
+            self.send_json(client_socket, history)
+
+    def send_info(self, client_socket, message):
+        self.send_json(client_socket, {"type": "info", "message": message})
+
+    def send_error(self, client_socket, message):
+        self.send_json(client_socket, {"type": "error", "message": message})
+
+    def send_rate_limited(self, client_socket, retry_after):
+        self.send_json(client_socket, {
+            "type": "error",
+            "code": "rate_limited",
+            "retry_after": round(retry_after, 1),
+            "message": f"⏳ Slow down! Messages are being dropped, retry in {retry_after:.1f}s"
+        })
+
+    AUTH_RESPONSE_TYPES = {"register": "register_response", "login": "login_response"}
+
+    def process_auth_request(self, auth_data, ip=None):
+        """Run a login/register request and build the response frame.
+
+        Returns (response_dict, username) where username is None unless the
+        request authenticated the client. Shared by every server mode.
+        """
+        request_type = auth_data.get("type")
+        if request_type == "resume":
+            return self.resume_session(auth_data)
+        if request_type not in self.AUTH_RESPONSE_TYPES:
+            return {"type": "error", "message": "Unknown request type"}, None
+        
+        limited = self.auth_rate_limited(auth_data, ip)
+        if limited is not None:
+            return limited, None
+        if not self.auth_slots.acquire(blocking=False):
+            return self.auth_busy_response(request_type), None
+        try:
+            return self.run_auth_request(auth_data)
+        finally:
+            self.auth_slots.release()
+
+    def resume_session(self, auth_data):
+        """Re-authenticate a reconnecting client from its session token.
+
+        Costs one HMAC: no bcrypt and no database round trip.
+        """
+        username = self.tokens.verify(auth_data.get("token"))
+        response = {
+            "type": "resume_response",
+            "success": username is not None,
+            "message": "Session resumed" if username else "Session expired, please login again"
+        }
+        return response, username
+
+    def count_auth(self, auth_data, username):
+        """Record an auth attempt (and failure) by request type"""
+        request_type = auth_data.get("type")
+        if request_type != "resume" and request_type not in self.AUTH_RESPONSE_TYPES:
+            return
+        metrics.AUTH_ATTEMPTS.inc(kind=request_type)
+        if username is None:
+            metrics.AUTH_FAILURES.inc(kind=request_type)
+
+    def auth_required_message(self):
+        """Greeting for a new connection, advertising optional encodings"""
+        return {
+            "type": "auth_required",
+            "message": "Welcome! Please login or register.",
+            "features": {
+                "encodings": supported_encodings(),
+                "compression": [ZLIB_COMPRESSION] if self.compress_threshold else []
+            }
+        }
+
+    def decode_auth_payload(self, client_socket, data):
+        """Decode one payload received before authentication.
+
+        Returns the request dict, or None when there is nothing left for
+        the caller to do: malformed payloads get an error reply and hello
+        requests are answered here.
+        """
+        try:
+            is_control, request = self.codec_for(client_socket).decode(data)
+        except ValueError:
+            is_control, request = False, None
+        
+        if not is_control or not isinstance(request, dict):
+            self.send_json(client_socket, {
+                "type": "error",
+                "message": "Invalid data format"
+            })
+            return None
+        
+        if request.get("type") == "hello":
+            if self.codec_for(client_socket) is PLAIN_CODEC:
+                self.negotiate(client_socket, request)
+            return None
+        if request.get("type") in ("ping", "pong"):
+            self.handle_control(client_socket, request)
+            return None
+        return request
+
+    def auth_success_message(self, username):
+        """Welcome frame for a newly authenticated client, with a resume token"""
+        return {
+            "type": "auth_success",
+            "message": f"Welcome to the chat, {username}!",
+            "token": self.tokens.issue(username)
+        }
+
+    def history_messages(self, room=DEFAULT_ROOM):
+        """Recent chat history of a room as history frames, oldest first.
+
+        Usually one frame; long lines split it so no frame exceeds
+        MAX_FRAME_SIZE. Lines stored before the length cap are truncated.
+        """
+        return self.history_frames(room, self.history.recent(room))
+
+    @staticmethod
+    def history_frames(room, rows):
+        rows = [dict(row, content=row["content"][:MAX_LINE_CHARS]) for row in rows]
+        return [
+            {
+                "type": "history",
+                "room": room,
+                "messages": [
+                    {
+                        "username": row["username"],
+                        "message": row["content"],
+                        "timestamp": row["created_at"].isoformat()
+                    }
+                    for row in batch
+                ]
+            }
+            for batch in frame_batches(rows)
+        ]
+
+    def auth_busy_response(self, request_type):
+        """Reply sent when too many auth attempts are already in flight"""
+        return {
+            "type": self.AUTH_RESPONSE_TYPES[request_type],
+            "success": False,
+            "message": "Server busy, please try again shortly"
+        }
+
+    def auth_rate_limited(self, auth_data, ip):
+        """Refusal for an IP or account over its login/register budget, else None.
+
+        Checked before bcrypt, so guessing passwords costs the server
+        nothing once the budget is spent. Resumes are exempt: a token check
+        is one HMAC and tokens cannot be guessed.
+        """
+        username = str(auth_data.get("username"))[:64]
+        retry_after, _ = self.auth_limit.check(username, ip)
+        if not retry_after:
+            return None
+        metrics.RATE_LIMITED.inc(kind="auth")
+        return {
+            "type": self.AUTH_RESPONSE_TYPES[auth_data.get("type")],
+            "success": False,
+            "code": "rate_limited",
+            "retry_after": round(retry_after, 1),
+            "message": f"Too many attempts, please wait {math.ceil(retry_after)}s"
+        }
+
+    def run_auth_request(self, auth_data):
+        """Blocking part of an auth request: DB lookup and bcrypt"""
+        request_type = auth_data.get("type")
+        username = auth_data.get("username")
+        password = auth_data.get("password")
+        
+        if request_type == "register":
+            success, message = self.db.register_user(username, password)
+        else:
+            success, message = self.db.authenticate_user(username, password)
+        
+        response = {
+            "type": self.AUTH_RESPONSE_TYPES[request_type],
+            "success": success,
+            "message": message
+        }
+        return response, (username if success else None)
+
+    def handle_authentication(self, client_socket, framed, ip=None):
         """Handle user authentication process"""
         try:
             # Send welcome message
-            welcome_msg = json.dumps({
-                "type": "auth_required",
-                "message": "Welcome! Please login or register."
-            })
-            client_socket.send(welcome_msg.encode('utf-8'))
+            self.send_json(client_socket, self.auth_required_message())
             
             while True:
-                data = client_socket.recv(1024)
-                if not data:
+                data = framed.recv()
+                if data is None:
                     return None
+                self.received(client_socket, data)
                 
-                try:
-                    auth_data = json.loads(data.decode('utf-8'))
-                except json.JSONDecodeError:
-                    error_msg = json.dumps({
-                        "type": "error",
-                        "message": "Invalid data format"
-                    })
-                    client_socket.send(error_msg.encode('utf-8'))
+                auth_data = self.decode_auth_payload(client_socket, data)
+                if auth_data is None:
                     continue
                 
-                if auth_data.get("type") == "register":
-                    username = auth_data.get("username")
-                    password = auth_data.get("password")
-                    
-                    success, message = self.db.register_user(username, password)
-                    
-                    response = json.dumps({
-                        "type": "register_response",
-                        "success": success,
-                        "message": message
-                    })
-                    client_socket.send(response.encode('utf-8'))
-                    
-                    if success:
-                        return username
-                
-                elif auth_data.get("type") == "login":
-                    username = auth_data.get("username")
-                    password = auth_data.get("password")
-                    
-                    success, message = self.db.authenticate_user(username, password)
-                    
-                    response = json.dumps({
-                        "type": "login_response",
-                        "success": success,
-                        "message": message
-                    })
-                    client_socket.send(response.encode('utf-8'))
-                    
-                    if success:
-                        return username
+                response, username = self.process_auth_request(auth_data, ip)
+                self.count_auth(auth_data, username)
+                self.send_json(client_socket, response)
                 
-                else:
-                    error_msg = json.dumps({
-                        "type": "error",
-                        "message": "Unknown request type"
-                    })
-                    client_socket.send(error_msg.encode('utf-8'))
+                if username:
+                    return username
         
         except Exception as e:
-            print(f"❌ Authentication error: {e}")
+            logger.error(f"❌ Authentication error: {e}")
             return None
 
+    def count_tls_handshake(self, tls_object, started=None):
+        """Record a finished TLS handshake (tls_object: SSLSocket/SSLObject)"""
+        metrics.TLS_HANDSHAKES.inc(result="resumed" if tls_object.session_reused else "full")
+        if started is not None:
+            metrics.TLS_HANDSHAKE_SECONDS.observe(time.perf_counter() - started)
+
+    def tls_handshake(self, client_socket, addr):
+        """Complete the TLS handshake on the client's thread; False if it failed"""
+        started = time.perf_counter()
+        try:
+            client_socket.do_handshake(timeout=self.tls_handshake_timeout)
+        except OSError as e:
+            metrics.TLS_HANDSHAKES.inc(result="failed")
+            logger.info(f"🔒 TLS handshake with {addr} failed: {e}")
+            return False
+        self.count_tls_handshake(client_socket, started)
+        return True
+
     def handle_client(self, client_socket, addr):
         """Handle authenticated client messages"""
-        print(f"🔌 New connection from {addr}")
+        logger.info(f"🔌 New connection from {addr}")
+        metrics.CONNECTIONS.inc()
+        try:
+            # Outbound writers batch frames already; Nagle would only delay
+            # them for a delayed ACK (e.g. behind TLS session tickets)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        if self.tls_context is not None and not self.tls_handshake(client_socket, addr):
+            self.connections.remove(client_socket)
+            client_socket.close()
+            return
+        framed = FramedSocket(client_socket)
+        self.create_outbound_queue(client_socket)
+        self.watch_connection(client_socket, client_socket)
         
         # First, authenticate the user
-        username = self.handle_authentication(client_socket)
+        username = self.handle_authentication(client_socket, framed, addr[0])
         
         if username is None:
-            print(f"❌ Authentication failed for {addr}")
+            logger.info(f"❌ Authentication failed for {addr}")
+            self.close_outbound_queue(client_socket)
+            self.connections.remove(client_socket)
             client_socket.close()
-            if client_socket in self.clients:
-                self.clients.remove(client_socket)
             return
         
-        # User is now authenticated
-        self.authenticated_clients[client_socket] = username
-        
-        # Send success message
-        success_msg = json.dumps({
-            "type": "auth_success",
-            "message": f"Welcome to the chat, {username}!"
-        })
-        client_socket.send(success_msg.encode('utf-8'))
-        
-        # Notify others
-        join_message = f"👋 {username} joined the chat"
-        self.broadcast(join_message, client_socket)
-        print(f"✅ {username} authenticated and joined from {addr}")
-        
-        # Handle regular chat messages
         try:
+            # Send success message and replay recent history
+            self.send_json(client_socket, self.auth_success_message(username))
+            self.replay_history(client_socket, DEFAULT_ROOM)
+            
+            # User is now authenticated; mail left before this point is in the mailbox
+            self.enter_chat(client_socket, username)
+            logger.info(f"✅ {username} authenticated and joined from {addr}")
+            self.deliver_mail(client_socket, username)
+            
+            # Handle regular chat messages
             while self.running:
-                message = client_socket.recv(1024)
-                if not message:
+                message = framed.recv()
+                if message is None:
                     break
+                self.received(client_socket, message)
                 
-                decoded_message = message.decode('utf-8')
+                is_control, decoded_message = self.codec_for(client_socket).decode(message, sniff_json=False)
+                if is_control:
+                    if isinstance(decoded_message, dict):
+                        self.handle_control(client_socket, decoded_message)
+                    continue
                 
-                if decoded_message.startswith("[leave]"):
+                if not self.process_chat_message(client_socket, username, decoded_message, addr[0]):
                     break
-                else:
-                    # Regular chat message - add username prefix
-                    chat_message = f"{username}: {decoded_message}"
-                    print(f"📩 {chat_message}")
-                    self.broadcast(chat_message, client_socket)
 
         except Exception as e:
-            print(f"❌ Error handling client {addr}: {e}")
+            if self.running:
+                logger.error(f"❌ Error handling client {addr}: {e}")
         finally:
             self.remove_client(client_socket)
             client_socket.close()
 
+    def open_listener(self):
+        """Take the listening socket over from a running server, or bind a new one"""
+        if self.take_over_path:
+            listen_socket, secret = take_over(self.take_over_path)
+            logger.info(f"🤝 Took over the listening socket from {self.take_over_path}")
+            if secret is not None and self.tokens.generated:
+                # Keep accepting the predecessor's tokens, or every client
+                # it hands us would have to log in again with bcrypt
+                self.tokens.secret = secret
+            elif secret is None and self.tokens.generated:
+                logger.warning("⚠️ No token secret received: resuming clients must log in again")
+            return listen_socket
+        return create_listen_socket(self.host, self.port, self.backlog, self.reuse_port)
+
+    def offer_listener(self, listen_socket):
+        """Let a successor started with --take-over inherit the listener"""
+        if self.handoff is None:
+            return
+        self.handoff.offer(listen_socket, self.request_stop, self.tokens.secret)
+        logger.info(f"🤝 Offering the listening socket to a successor at {self.handoff.path}")
+
+    def request_stop(self):
+        """Ask the accept loop to stop (safe from any thread); it then drains"""
+        self.running = False
+
+    def reconnect_message(self):
+        """Shutdown notice with a random backoff, so clients don't return all at once"""
+        retry_after = round(random.uniform(1.0, max(self.reconnect_spread, 1.0)), 1)
+        return {
+            "type": "reconnect",
+            "retry_after": retry_after,
+            "message": f"🔄 Server restarting, reconnecting in {retry_after:g}s"
+        }
+
+    def drain(self):
+        """Send every client a reconnect hint and flush its outbound queue.
+
+        Clients resume with their session token (no bcrypt) after their
+        own random delay. Pending history and last-seen writes are flushed
+        by stop_server afterwards.
+        """
+        self.draining = True
+        states = self.connections.snapshot()
+        for state in states:
+            self.send_json(state.conn, self.reconnect_message())
+            if state.outbound is not None:
+                state.outbound.close(flush=True)
+        deadline = time.monotonic() + self.drain_timeout
+        for state in states:
+            queue = state.outbound
+            if queue is not None:
+                queue.thread.join(max(0.0, deadline - time.monotonic()))
+        logger.info(f"🚰 Drained {len(states)} connections")
+
+    ACCEPT_POLL = 1.0  # Seconds; how quickly the accept loop notices request_stop()
+
     def start_server(self):
-        """Start the authentication-enabled chat server"""
+        """Start the authentication-enabled chat server.
+
+        Returns False if it failed (e.g. the port is taken) rather than
+        being stopped.
+        """
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket = self.open_listener()
+            # A blocked accept() is not woken by close() from another thread
+            self.server_socket.settimeout(self.ACCEPT_POLL)
             self.running = True
+            self.start_backplane()
+            self.start_metrics()
+            self.offer_listener(self.server_socket)
+            if self.heartbeats is not None:
+                threading.Thread(target=self.run_heartbeats, daemon=True).start()
+            if self.backplane is not None and self.backplane_heartbeat:
+                threading.Thread(target=self.run_backplane_heartbeats, daemon=True).start()
 
-            print(f"🚀 Auth Chat Server started on {self.host}:{self.port}")
-            print("🔐 Authentication required for all users")
-            print("=" * 50)
+            logger.info(f"🚀 Auth Chat Server started on {self.host}:{self.port}")
+            if self.tls_context is not None:
+                logger.info("🔒 TLS enabled")
+            logger.info("🔐 Authentication required for all users")
+            logger.info("=" * 50)
 
             while self.running:
                 try:
                     client_socket, addr = self.server_socket.accept()
-                    self.clients.append(client_socket)
+                    if self.tls_context is not None:
+                        # No I/O here: the handshake happens in handle_client
+                        try:
+                            client_socket = TLSSocket(self.tls_context.wrap_socket(
+                                client_socket, server_side=True, do_handshake_on_connect=False
+                            ))
+                        except OSError:
+                            client_socket.close()  # Already reset by the peer
+                            continue
+                    self.connections.add(client_socket, addr)
 
                     # Create thread for each client
                     thread = threading.Thread(
@@ -192,44 +1161,294 @@ class AuthChatServer:
                     )
                     thread.start()
                     
+                except socket.timeout:
+                    continue
                 except OSError:
                     if self.running:
-                        print("Server socket closed")
+                        logger.info("Server socket closed")
                     break
 
         except Exception as e:
-            print(f"❌ Server error: {e}")
+            logger.error(f"❌ Server error: {e}")
+            return False
         finally:
             self.stop_server()
+        return True
 
     def stop_server(self):
-        """Stop the server and close all connections"""
-        print("\n🛑 Shutting down server...")
+        """Stop the server, draining clients first, and close all connections"""
+        logger.info("\n🛑 Shutting down server...")
         self.running = False
         
-        # Close all client connections
-        for client in self.clients[:]:
+        # Stop accepting first so no new client slips in during shutdown
+        if self.server_socket:
             try:
-                client.close()
+                self.server_socket.close()
             except:
                 pass
+        if self.handoff is not None:
+            self.handoff.close()
         
-        # Close server socket
-        if self.server_socket:
+        if self.drain_timeout:
+            self.drain()
+        
+        # Close all client connections
+        for state in self.connections.snapshot():
+            self.close_outbound_queue(state.conn)
+            self.drop_client(state.conn)  # Wakes its handler thread
             try:
-                self.server_socket.close()
+                state.conn.close()
             except:
                 pass
         
-        print("✅ Server stopped successfully")
+        self.history.close()
+        self.presence.close()
+        self.mail_unconfirmed_directs()
+        self.mailbox.close()
+        if self.backplane is not None:
+            self.backplane.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        logger.info(f"📊 Credential cache: {self.db.cache.stats()}")
+        self.db.close()
+        
+        logger.info("✅ Server stopped successfully")
 
-def main():
-    server = AuthChatServer()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Auth Chat Server")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    parser.add_argument("--port", type=int, default=5555, help="Port to listen on")
+    parser.add_argument(
+        "--mode", choices=["threaded", "asyncio"], default="threaded",
+        help="threaded: one thread per client; asyncio: single event loop"
+    )
+    parser.add_argument(
+        "--backlog", type=int, default=1024,
+        help="Listen backlog: pending connections the kernel queues during bursts"
+    )
+    parser.add_argument(
+        "--reuse-port", action="store_true",
+        help="Set SO_REUSEPORT so several processes can share the port"
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+        help="Max frames buffered per client before the slow consumer policy kicks in"
+    )
+    parser.add_argument(
+        "--slow-consumer", choices=SLOW_CONSUMER_POLICIES, default=DROP_OLDEST,
+        help="drop_oldest: discard the oldest queued frames; disconnect: drop the client"
+    )
+    parser.add_argument(
+        "--db-url", default=DEFAULT_DB_URL,
+        help="SQLAlchemy database URL (defaults to $CHAT_DB_URL or the local SQLite file)"
+    )
+    parser.add_argument("--db-pool-size", type=int, default=10, help="Pooled DB connections")
+    parser.add_argument(
+        "--cache-size", type=int, default=10000,
+        help="Usernames kept in the in-memory credential cache"
+    )
+    parser.add_argument(
+        "--cache-ttl", type=float, default=300.0,
+        help="Seconds a cached credential stays valid"
+    )
+    parser.add_argument(
+        "--token-ttl", type=int, default=3600,
+        help="Seconds a session resume token stays valid (secret: $CHAT_TOKEN_SECRET)"
+    )
+    parser.add_argument(
+        "--history-size", type=int, default=50,
+        help="Messages replayed to a client when it joins"
+    )
+    parser.add_argument(
+        "--history-flush-interval", type=float, default=0.2,
+        help="Seconds between group commits of chat history"
+    )
+    parser.add_argument(
+        "--last-seen-flush-interval", type=float, default=30.0,
+        help="Seconds between batched writes of users' last-seen times"
+    )
+    parser.add_argument(
+        "--backplane", default=None,
+        help="Relay messages between server processes: unix:///path.sock or redis://host:port/0"
+    )
+    parser.add_argument(
+        "--backplane-heartbeat", type=float, default=10.0,
+        help="Seconds between backplane heartbeats; a node silent for three is taken for dead (0: off)"
+    )
+    parser.add_argument(
+        "--coalesce-ms", type=float, default=2.0,
+        help="Gather a client's outbound frames for up to this long into one write (0: off; "
+             "tunable at runtime via POST /settings?coalesce_ms=N on the metrics port)"
+    )
+    parser.add_argument(
+        "--compress-threshold", type=int, default=COMPRESS_THRESHOLD,
+        help="Compress control frames of at least this many bytes for clients that negotiate zlib (0: never)"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=None,
+        help="Serve Prometheus metrics on this port (off by default)"
+    )
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address for the metrics endpoint")
+    parser.add_argument(
+        "--log-level", choices=LOG_LEVELS, default="info",
+        help="debug also logs every chat message"
+    )
+    parser.add_argument(
+        "--msg-rate", type=float, default=10.0,
+        help="Chat lines/commands per second allowed per user (0: unlimited)"
+    )
+    parser.add_argument("--msg-burst", type=int, default=20, help="Chat lines a user may send at once")
+    parser.add_argument(
+        "--auth-rate", type=float, default=0.2,
+        help="Login/register attempts per second allowed per account (0: unlimited)"
+    )
+    parser.add_argument("--auth-burst", type=int, default=5, help="Auth attempts allowed at once")
+    parser.add_argument(
+        "--ip-limit-multiplier", type=float, default=5.0,
+        help="Per-IP budgets are this many times the per-user ones (room for NAT)"
+    )
+    parser.add_argument(
+        "--rate-limit-keys", type=int, default=100000,
+        help="Max users/IPs tracked per budget; the least recently seen are evicted"
+    )
+    parser.add_argument(
+        "--ping-interval", type=float, default=30.0,
+        help="Ping clients quiet for this many seconds (0: no heartbeats or idle reaping)"
+    )
+    parser.add_argument(
+        "--idle-timeout", type=float, default=90.0,
+        help="Drop clients that sent nothing, not even a pong, for this many seconds"
+    )
+    parser.add_argument(
+        "--keepalive-idle", type=int, default=60,
+        help="TCP keepalive: idle seconds before the first probe (0: keepalive off)"
+    )
+    parser.add_argument("--keepalive-interval", type=int, default=10, help="TCP keepalive: seconds between probes")
+    parser.add_argument("--keepalive-count", type=int, default=5, help="TCP keepalive: failed probes before reset")
+    parser.add_argument(
+        "--drain-timeout", type=float, default=5.0,
+        help="On shutdown, seconds clients' queued frames get to flush after the reconnect notice (0: close at once)"
+    )
+    parser.add_argument(
+        "--reconnect-spread", type=float, default=10.0,
+        help="Clients are told to reconnect after a random delay of up to this many seconds"
+    )
+    parser.add_argument(
+        "--handoff-socket", default=None,
+        help="Unix socket path where a replacement server can take over the listening socket"
+    )
+    parser.add_argument(
+        "--take-over", default=None, metavar="PATH",
+        help="Start on the listening socket of the server offering it at PATH, which then drains"
+    )
+    parser.add_argument(
+        "--tls-cert", default=None, metavar="PEM",
+        help="Serve TLS with this certificate chain (plaintext TCP if omitted)"
+    )
+    parser.add_argument("--tls-key", default=None, metavar="PEM", help="Private key, if not in --tls-cert")
+    parser.add_argument(
+        "--tls-handshake-timeout", type=float, default=10.0,
+        help="Seconds a client gets to complete the TLS handshake"
+    )
+    parser.add_argument(
+        "--mailbox-size", type=int, default=500,
+        help="Direct messages kept per offline user; older ones are dropped"
+    )
+    parser.add_argument(
+        "--mailbox-days", type=float, default=30.0,
+        help="Days a direct message waits for an offline user before it is dropped"
+    )
+    parser.add_argument("--hash-workers", type=int, default=4, help="bcrypt worker count")
+    parser.add_argument(
+        "--hash-pool", choices=POOL_KINDS, default="thread",
+        help="Run bcrypt on a thread pool or a process pool"
+    )
+    parser.add_argument(
+        "--max-pending-hashes", type=int, default=64,
+        help="bcrypt jobs allowed to wait for a worker before auth is refused"
+    )
+    parser.add_argument(
+        "--max-concurrent-auth", type=int, default=32,
+        help="Login/register attempts processed at once; extras get a busy reply"
+    )
+    return parser.parse_args(argv)
+
+def create_server(args):
+    """Build the server implementation selected on the command line"""
+    if args.mode == "asyncio":
+        from asyncserver import AsyncAuthChatServer
+        server_class = AsyncAuthChatServer
+    else:
+        server_class = AuthChatServer
+    return server_class(
+        args.host, args.port,
+        queue_size=args.queue_size,
+        slow_consumer_policy=args.slow_consumer,
+        max_concurrent_auth=args.max_concurrent_auth,
+        db_url=args.db_url,
+        db_pool_size=args.db_pool_size,
+        history_size=args.history_size,
+        history_flush_interval=args.history_flush_interval,
+        backplane=create_backplane(args.backplane),
+        backlog=args.backlog,
+        reuse_port=args.reuse_port,
+        metrics_host=args.metrics_host,
+        metrics_port=args.metrics_port,
+        compress_threshold=args.compress_threshold,
+        coalesce_ms=args.coalesce_ms,
+        last_seen_flush_interval=args.last_seen_flush_interval,
+        message_rate=args.msg_rate,
+        message_burst=args.msg_burst,
+        auth_rate=args.auth_rate,
+        auth_burst=args.auth_burst,
+        ip_limit_multiplier=args.ip_limit_multiplier,
+        rate_limit_keys=args.rate_limit_keys,
+        ping_interval=args.ping_interval,
+        drain_timeout=args.drain_timeout,
+        reconnect_spread=args.reconnect_spread,
+        handoff_path=args.handoff_socket,
+        take_over_path=args.take_over,
+        tls_context=server_context(args.tls_cert, args.tls_key) if args.tls_cert else None,
+        tls_handshake_timeout=args.tls_handshake_timeout,
+        mailbox_size=args.mailbox_size,
+        mailbox_days=args.mailbox_days,
+        backplane_heartbeat=args.backplane_heartbeat,
+        idle_timeout=args.idle_timeout,
+        keepalive=(
+            (args.keepalive_idle, args.keepalive_interval, args.keepalive_count)
+            if args.keepalive_idle else None
+        ),
+        session_tokens=SessionTokens(ttl=args.token_ttl),
+        credential_cache=CredentialCache(max_size=args.cache_size, ttl=args.cache_ttl),
+        hasher=PasswordHasher(
+            workers=args.hash_workers,
+            kind=args.hash_pool,
+            max_pending=args.max_pending_hashes
+        )
+    )
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def run_server(args):
+    """Build and run a server until it stops or is interrupted; False if it failed"""
+    setup_logging(args.log_level)
+    check_frame_limits()
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM (deploys, the supervisor) drains just like Ctrl+C
+        signal.signal(signal.SIGTERM, interrupt)
+    server = create_server(args)
     try:
-        server.start_server()
+        # start_server stops (and drains) the server on its way out
+        return server.start_server()
     except KeyboardInterrupt:
-        print("\n🔴 Server interrupted by user")
-        server.stop_server()
+        logger.info("\n🔴 Server interrupted by user")
+        return True
+    finally:
+        stop_logging()
+
+def main():
+    sys.exit(0 if run_server(parse_args()) else 1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,345 @@
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from outbound import DISCONNECT, OutboundQueue
+from protocol import FramedSocket, decode_json, encode_frame, encode_json
+
+logger = logging.getLogger("chat.backplane")
+
+DEFAULT_SOCKET_PATH = "/tmp/chat-backplane.sock"
+
+class Backplane:
+    """Relays broadcasts and presence between server processes.
+
+    Servers publish events (plain dicts) and receive everyone else's
+    through the handler passed to start(). Implementations must deliver
+    one publisher's events in the order they were published, and close()
+    tells the other nodes this one is gone ("node_down").
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex[:12]
+        self.handler = None
+
+    def start(self, handler):
+        """Begin delivering events from other nodes to handler(event)"""
+        self.handler = handler
+
+    def publish(self, event):
+        raise NotImplementedError
+
+    def deliver(self, event):
+        # Never hand a node its own events back
+        if self.handler is not None and event.get("origin") != self.node_id:
+            self.handler(event)
+
+    def close(self):
+        self.publish({"kind": "node_down"})
+
+class LocalHub:
+    """In-process broker connecting LocalBackplane instances (for tests)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.members = []
+
+    def attach(self, backplane):
+        with self.lock:
+            self.members.append(backplane)
+
+    def detach(self, backplane):
+        with self.lock:
+            if backplane in self.members:
+                self.members.remove(backplane)
+
+    def publish(self, event):
+        # Delivering under the lock keeps a global publish order
+        with self.lock:
+            for member in self.members:
+                member.deliver(event)
+
+class LocalBackplane(Backplane):
+    """Backplane for several servers living in one process"""
+
+    def __init__(self, hub):
+        super().__init__()
+        self.hub = hub
+
+    def start(self, handler):
+        super().start(handler)
+        self.hub.attach(self)
+
+    def publish(self, event):
+        event["origin"] = self.node_id
+        self.hub.publish(event)
+
+    def close(self):
+        super().close()
+        self.hub.detach(self)
+
+class UnixSocketBroker:
+    """Tiny fan-out broker: every frame a peer sends goes to all other peers.
+
+    Each peer has its own writer queue, and frames from one peer are read
+    and relayed in order, so per-sender ordering holds end to end. When a
+    peer's connection ends, the others get a "node_down" event for it, so
+    a crashed or dropped node's users do not linger in their presence.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, queue_size=10000):
+        self.path = path
+        self.queue_size = queue_size
+        self.peers = {}  # socket -> OutboundQueue
+        self.nodes = {}  # socket -> node id, from the origin of its first event
+        self.lock = threading.Lock()
+        self.server_socket = None
+        self.running = False
+
+    def start(self):
+        """Bind the socket and accept peers on a background thread"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(self.path)
+        self.server_socket.listen(128)
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                peer, _ = self.server_socket.accept()
+            except OSError:
+                break
+            with self.lock:
+                self.peers[peer] = OutboundQueue(peer, self.queue_size, DISCONNECT)
+            threading.Thread(target=self.relay_loop, args=(peer,), daemon=True).start()
+
+    def relay_loop(self, peer):
+        framed = FramedSocket(peer)
+        try:
+            while self.running:
+                payload = framed.recv()
+                if payload is None:
+                    break
+                if peer not in self.nodes:
+                    self.learn_node(peer, payload)
+                self.relay(encode_frame(payload), exclude=peer)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                queue = self.peers.pop(peer, None)
+                node = self.nodes.pop(peer, None)
+                # A node that already reconnected is not down
+                gone = node is not None and node not in self.nodes.values()
+            if queue is not None:
+                queue.close()
+            peer.close()
+            if gone and self.running:
+                self.relay(encode_json({"kind": "node_down", "origin": node}))
+
+    def learn_node(self, peer, payload):
+        try:
+            node = decode_json(payload).get("origin")
+        except (ValueError, AttributeError):
+            return
+        if node:
+            with self.lock:
+                self.nodes[peer] = node
+
+    def relay(self, frame, exclude=None):
+        """Queue a frame for every peer but exclude"""
+        with self.lock:
+            targets = [(sock, queue) for sock, queue in self.peers.items() if sock is not exclude]
+        for sock, queue in targets:
+            if not queue.put(frame):
+                # Too far behind: hang up, so the node notices and
+                # reconnects instead of silently missing events
+                self.drop_peer(sock)
+
+    def drop_peer(self, peer):
+        """Force a peer's connection closed; its relay thread cleans up"""
+        try:
+            peer.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stop(self):
+        self.running = False
+        if self.server_socket:
+            self.server_socket.close()
+        with self.lock:
+            for peer, queue in self.peers.items():
+                queue.close()
+                self.drop_peer(peer)  # close() alone would not wake its reader
+                peer.close()
+            self.peers.clear()
+            self.nodes.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class UnixSocketBackplane(Backplane):
+    """Backplane client for UnixSocketBroker.
+
+    When the broker goes away (restart, or it dropped us for falling
+    behind) the reader reconnects with jittered exponential backoff, then
+    resynchronizes presence both ways. Events published while disconnected
+    are lost.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, backoff=0.5, max_backoff=10.0):
+        super().__init__()
+        self.path = path
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.conn = None
+        self.closed = False
+        self.send_lock = threading.Lock()
+
+    def start(self, handler):
+        super().start(handler)
+        self.connect()
+        threading.Thread(target=self.read_loop, daemon=True).start()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        with self.send_lock:
+            self.conn = FramedSocket(sock)
+
+    def read_loop(self):
+        while not self.closed:
+            try:
+                while True:
+                    payload = self.conn.recv()
+                    if payload is None:
+                        break
+                    self.deliver(decode_json(payload))
+            except (OSError, ValueError):
+                pass
+            if self.closed:
+                return
+            logger.warning("⚠️ Backplane connection lost, reconnecting")
+            with self.send_lock:
+                self.conn.close()
+                self.conn = None
+            if self.reconnect():
+                logger.info("🔀 Backplane reconnected")
+
+    def reconnect(self):
+        """Reconnect until it works (or we close); then resync presence"""
+        attempt = 0
+        while not self.closed:
+            time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+            attempt += 1
+            try:
+                self.connect()
+            except OSError:
+                continue
+            # Peers missed our presence changes and we missed theirs: ask
+            # them for snapshots, and have our own server publish one
+            self.publish({"kind": "presence_sync"})
+            if self.handler is not None:
+                self.handler({"kind": "presence_sync"})
+            return True
+        return False
+
+    def publish(self, event):
+        event["origin"] = self.node_id
+        frame = encode_json(event)
+        # One sendall per event under a lock keeps publish order intact
+        with self.send_lock:
+            if self.conn is None:
+                return  # Reconnecting: the presence resync covers what matters
+            try:
+                self.conn.sock.sendall(frame)
+            except OSError as e:
+                logger.error(f"❌ Backplane publish failed: {e}")
+
+    def close(self):
+        super().close()
+        self.closed = True
+        with self.send_lock:
+            if self.conn:
+                self.conn.close()
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis pub/sub (or anything speaking its protocol)"""
+
+    CHANNEL = "chat:backplane"
+
+    def __init__(self, url):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis backplane needs the 'redis' package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.pubsub = None
+        self.thread = None
+
+    def start(self, handler):
+        super().start(handler)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(**{self.CHANNEL: self.on_redis_message})
+        self.thread = self.pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+
+    def on_redis_message(self, message):
+        try:
+            self.deliver(decode_json(message["data"]))
+        except ValueError:
+            pass
+
+    def publish(self, event):
+        event["origin"] = self.node_id
+        self.client.publish(self.CHANNEL, json.dumps(event))
+
+    def close(self):
+        try:
+            super().close()
+        except Exception as e:
+            # The redis package's errors; peers expire us by heartbeat
+            logger.error(f"❌ Backplane goodbye failed: {e}")
+        if self.thread:
+            self.thread.stop()
+        if self.pubsub:
+            self.pubsub.close()
+
+def create_backplane(url):
+    """Build a backplane from a URL: unix:///path.sock or redis://host:port/db"""
+    if not url:
+        return None
+    if url.startswith("unix://"):
+        return UnixSocketBackplane(url[len("unix://"):] or DEFAULT_SOCKET_PATH)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackplane(url)
+    raise ValueError(f"Unsupported backplane URL: {url}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Unix socket backplane broker")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Socket path to listen on")
+    args = parser.parse_args()
+
+    broker = UnixSocketBroker(args.socket)
+    broker.start()
+    print(f"🔀 Backplane broker listening on {args.socket}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print("\n🔴 Broker interrupted by user")
+    finally:
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
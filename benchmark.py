@@ -0,0 +1,473 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from asyncclient import CONNECTION_ERRORS, AsyncChatClient, AuthError
+from protocol import JSON_ENCODING, MSGPACK_ENCODING, FramedSocket
+from tls import client_context, generate_self_signed
+
+MARKER = "bench"
+
+def percentiles(samples):
+    """Summarize latency samples (seconds) as milliseconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def pick(fraction):
+        return round(ordered[min(count - 1, int(fraction * count))] * 1000, 3)
+
+    return {
+        "count": count,
+        "mean": round(sum(ordered) / count * 1000, 3),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(ordered[-1] * 1000, 3)
+    }
+
+def read_rss(pid):
+    """Resident set size of a process in bytes (Linux), or None"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def raise_fd_limit():
+    """Thousands of simulated users need thousands of file descriptors"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class BenchUser:
+    """One simulated user: an AsyncChatClient plus delivery bookkeeping"""
+
+    def __init__(self, bench, index):
+        self.bench = bench
+        self.index = index
+        self.username = f"b{bench.run_id}_{index}"
+        self.room = f"bench-{index // bench.room_size}"
+        self.client = None
+        self.receive_task = None
+
+    def record_latency(self, stage, seconds):
+        if stage == "connect":
+            self.bench.connect_latency.append(seconds)
+        elif stage in self.bench.auth_latency:
+            self.bench.auth_latency[stage].append(seconds)
+
+    async def connect(self):
+        """A fresh connection; benchmark users never reconnect on their own"""
+        self.client = AsyncChatClient(
+            self.bench.host, self.bench.port, tls_context=self.bench.tls_context,
+            negotiate=self.bench.encoding is not None, compress=self.bench.compress,
+            encodings=[self.bench.encoding] if self.bench.encoding else None,
+            reconnect_attempts=0, on_latency=self.record_latency
+        )
+        await self.client.connect()
+
+    async def authenticate(self, kind):
+        """Run the auth handshake; returns True once auth_success arrives"""
+        request = self.client.register if kind == "register" else self.client.login
+        for attempt in range(self.bench.auth_retries + 1):
+            try:
+                await request(self.username, self.bench.password)
+                return True
+            except AuthError as e:
+                if "busy" not in str(e).lower():
+                    break
+                self.bench.auth_busy += 1
+                await asyncio.sleep(0.05 * (attempt + 1))
+
+        self.bench.auth_failures += 1
+        return False
+
+    async def receive(self):
+        """Count deliveries of benchmark messages and their latency"""
+        async for event in self.client:
+            if event.get("type") != "chat":
+                continue
+            _, _, body = event["message"].partition(": ")
+            parts = body.split(" ")
+            if len(parts) == 3 and parts[0] == MARKER:
+                self.bench.record_delivery(parts[1], float(parts[2]))
+
+    def start_receiving(self):
+        self.receive_task = asyncio.get_running_loop().create_task(self.receive())
+
+    def send(self, text):
+        self.client.send(text)
+
+    async def chat(self, count, interval):
+        for seq in range(count):
+            message_id = f"{self.index}.{seq}"
+            self.bench.expect(message_id, self.room)
+            self.send(f"{MARKER} {message_id} {time.perf_counter():.6f}")
+            await self.client.drain()
+            await asyncio.sleep(interval)
+
+    async def close(self, leave=True):
+        if self.client is None:
+            return
+        client, self.client = self.client, None
+        await client.close(leave)
+        self.bench.bytes_in += client.bytes_in
+        self.bench.bytes_out += client.bytes_out
+        if self.receive_task is not None:
+            self.receive_task.cancel()
+            self.receive_task = None
+
+class LoadGenerator:
+    """Drives register -> login -> chat -> leave for many concurrent users"""
+
+    def __init__(self, host, port, users=200, room_size=20, messages=10, rate=2.0,
+                 concurrency=32, auth_retries=5, settle=1.0, server_pid=None,
+                 encoding=None, compress=False, tls_context=None):
+        self.host = host
+        self.port = port
+        self.users = users
+        self.room_size = max(1, room_size)
+        self.messages = messages
+        self.rate = rate
+        self.concurrency = concurrency
+        self.auth_retries = auth_retries
+        self.settle = settle
+        self.server_pid = server_pid
+        self.encoding = encoding  # None: stay on the plain format
+        self.compress = compress
+        self.tls_context = tls_context
+        self.run_id = uuid.uuid4().hex[:6]
+        self.password = "bench-password"
+
+        self.connect_latency = []
+        self.auth_latency = {"register": [], "login": []}
+        self.auth_failures = 0
+        self.auth_busy = 0
+        self.delivery_latency = []
+        self.fanout_latency = []
+        self.pending = {}  # message id -> [recipients left, slowest delivery]
+        self.room_members = {}
+        self.expected_deliveries = 0
+        self.deliveries = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def expect(self, message_id, room):
+        recipients = self.room_members[room] - 1
+        self.expected_deliveries += recipients
+        if recipients:
+            self.pending[message_id] = [recipients, 0.0]
+
+    def record_delivery(self, message_id, sent_at):
+        latency = time.perf_counter() - sent_at
+        self.deliveries += 1
+        self.delivery_latency.append(latency)
+        entry = self.pending.get(message_id)
+        if entry is None:
+            return
+        entry[0] -= 1
+        entry[1] = max(entry[1], latency)
+        if entry[0] == 0:
+            self.fanout_latency.append(entry[1])
+            del self.pending[message_id]
+
+    async def gather_limited(self, coroutines):
+        """Run coroutines with at most `concurrency` in flight"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(coroutine):
+            async with semaphore:
+                try:
+                    return await coroutine
+                except CONNECTION_ERRORS + (ValueError, AttributeError):
+                    return False
+
+        return await asyncio.gather(*(limited(coroutine) for coroutine in coroutines))
+
+    async def run(self):
+        users = [BenchUser(self, index) for index in range(self.users)]
+        for user in users:
+            self.room_members[user.room] = self.room_members.get(user.room, 0) + 1
+
+        # Phase 1: register everyone (bcrypt hash per user)
+        await self.gather_limited(self.register(user) for user in users)
+        await asyncio.gather(*(user.close() for user in users))
+
+        # Phase 2: log everyone back in; this is the connection-rate window
+        started = time.perf_counter()
+        results = await self.gather_limited(self.login(user) for user in users)
+        login_elapsed = time.perf_counter() - started
+        online = [user for user, ok in zip(users, results) if ok]
+
+        # Phase 3: join rooms, then chat
+        for user in online:
+            user.start_receiving()
+            user.send(f"/join {user.room}")
+        await asyncio.sleep(self.settle)
+        self.room_members = {}
+        for user in online:
+            self.room_members[user.room] = self.room_members.get(user.room, 0) + 1
+
+        interval = 1.0 / self.rate if self.rate > 0 else 0
+        started = time.perf_counter()
+        await asyncio.gather(*(user.chat(self.messages, interval) for user in online))
+        deadline = time.monotonic() + max(5.0, self.settle)
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        chat_elapsed = time.perf_counter() - started
+        server_rss = read_rss(self.server_pid) if self.server_pid else None
+
+        # Phase 4: leave (and drop connections whose login was refused)
+        await asyncio.gather(*(user.close() for user in users))
+
+        messages_sent = len(online) * self.messages
+        return {
+            "config": {
+                "users": self.users,
+                "room_size": self.room_size,
+                "messages_per_user": self.messages,
+                "rate_per_user": self.rate,
+                "concurrency": self.concurrency,
+                "encoding": self.encoding or "plain",
+                "compression": self.compress,
+                "tls": self.tls_context is not None
+            },
+            "connections": {
+                "online": len(online),
+                "connect_latency_ms": percentiles(self.connect_latency),
+                "logins_per_sec": round(len(online) / login_elapsed, 2) if login_elapsed else None
+            },
+            "auth": {
+                "register_latency_ms": percentiles(self.auth_latency["register"]),
+                "login_latency_ms": percentiles(self.auth_latency["login"]),
+                "busy_retries": self.auth_busy,
+                "failures": self.auth_failures
+            },
+            "broadcast": {
+                "delivery_latency_ms": percentiles(self.delivery_latency),
+                "fanout_latency_ms": percentiles(self.fanout_latency),
+                "expected_deliveries": self.expected_deliveries,
+                "deliveries": self.deliveries,
+                "incomplete_messages": len(self.pending)
+            },
+            "throughput": {
+                "messages_sent": messages_sent,
+                "messages_per_sec": round(messages_sent / chat_elapsed, 2),
+                "deliveries_per_sec": round(self.deliveries / chat_elapsed, 2),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out
+            },
+            "server": {"pid": self.server_pid, "rss_bytes": server_rss}
+        }
+
+    async def register(self, user):
+        await user.connect()
+        return await user.authenticate("register")
+
+    async def login(self, user):
+        await user.connect()
+        return await user.authenticate("login")
+
+def connection_rate(host, port, count, concurrency, tls_context=None, resume=False):
+    """Time `count` bare connections, `concurrency` at a time.
+
+    Each one connects, completes the TLS handshake if any, reads the
+    server's greeting and closes, which isolates connection setup from
+    auth and chat. With resume, every connection offers the TLS session
+    of the previous one made by the same worker.
+    """
+    def worker(connections):
+        latencies, resumed, failures = [], 0, 0
+        session = None
+        for _ in range(connections):
+            started = time.perf_counter()
+            try:
+                sock = socket.create_connection((host, port), timeout=10)
+                if tls_context is not None:
+                    sock = tls_context.wrap_socket(sock, server_hostname=host, session=session)
+                with sock:
+                    if FramedSocket(sock).recv() is None:
+                        raise ConnectionError("No greeting")
+                    latencies.append(time.perf_counter() - started)
+                    if tls_context is not None:
+                        resumed += sock.session_reused
+                        if resume:
+                            session = sock.session
+            except OSError:
+                failures += 1
+        return latencies, resumed, failures
+
+    concurrency = max(1, min(concurrency, count))
+    shares = [count // concurrency + (index < count % concurrency) for index in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(worker, shares))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for outcome in outcomes for latency in outcome[0]]
+    return {
+        "connections": len(latencies),
+        "connections_per_sec": round(len(latencies) / elapsed, 2),
+        "latency_ms": percentiles(latencies),
+        "resumed": sum(outcome[1] for outcome in outcomes),
+        "failures": sum(outcome[2] for outcome in outcomes)
+    }
+
+def self_signed_tls(workdir):
+    """Server arguments and a client context for a fresh self-signed certificate"""
+    certfile = os.path.join(workdir, "cert.pem")
+    keyfile = os.path.join(workdir, "key.pem")
+    generate_self_signed(certfile, keyfile)
+    return ["--tls-cert", certfile, "--tls-key", keyfile], client_context(certfile)
+
+def compare_connection_rates(args, server_args, workdir):
+    """Connection rate over plaintext and over TLS, full and resumed handshakes.
+
+    With --spawn-server a plaintext server and then a TLS one (self-signed
+    certificate) are started in turn; otherwise the given server is
+    measured as it is, over TLS if --tls was passed.
+    """
+    def measure(tls_context=None, resume=False):
+        return connection_rate(
+            args.host, args.port, args.connection_rate, args.concurrency, tls_context, resume
+        )
+
+    results = {"config": {"connections": args.connection_rate, "concurrency": args.concurrency}}
+    if not args.spawn_server:
+        if args.tls:
+            context = client_context(args.ca_file)
+            results["tls_full"] = measure(context)
+            results["tls_resumed"] = measure(context, resume=True)
+        else:
+            results["plain"] = measure()
+        return results
+
+    tls_args, context = self_signed_tls(workdir)
+    server = spawn_server(args.port, args.spawn_server, server_args, workdir)
+    try:
+        results["plain"] = measure()
+    finally:
+        stop_spawned(server)
+    server = spawn_server(args.port, args.spawn_server, server_args + tls_args, workdir)
+    try:
+        results["tls_full"] = measure(context)
+        results["tls_resumed"] = measure(context, resume=True)
+    finally:
+        stop_spawned(server)
+    plain = results["plain"]["connections_per_sec"]
+    if plain:
+        results["tls_overhead"] = {
+            variant: round(1 - results[variant]["connections_per_sec"] / plain, 3)
+            for variant in ("tls_full", "tls_resumed")
+        }
+    return results
+
+def stop_spawned(server):
+    server.send_signal(signal.SIGINT)
+    server.wait(timeout=30)
+
+def spawn_server(port, mode, extra_args, workdir):
+    """Start a throwaway server with its own database for the run"""
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "authserver.py"),
+        "--port", str(port), "--mode", mode,
+        "--db-url", f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        # Every simulated user shares one IP; measure the server, not the limiter
+        "--msg-rate", "0", "--auth-rate", "0"
+    ] + extra_args
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(2)
+    return process
+
+def run_load(args, server_args, workdir):
+    """The chat load: register, log in, chat and leave with many users"""
+    server = None
+    tls_context = None
+    if args.tls and args.spawn_server:
+        tls_args, tls_context = self_signed_tls(workdir)
+        server_args = server_args + tls_args
+    elif args.tls:
+        tls_context = client_context(args.ca_file)
+    if args.spawn_server:
+        server = spawn_server(args.port, args.spawn_server, server_args, workdir)
+        args.server_pid = server.pid
+
+    generator = LoadGenerator(
+        args.host, args.port,
+        users=args.users, room_size=args.room_size, messages=args.messages,
+        rate=args.rate, concurrency=args.concurrency, server_pid=args.server_pid,
+        encoding=None if args.encoding == "plain" else args.encoding, compress=args.compress,
+        tls_context=tls_context
+    )
+    try:
+        return asyncio.run(generator.run())
+    finally:
+        if server is not None:
+            stop_spawned(server)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Headless load generator for the Auth Chat Server",
+        epilog="Unknown options are passed to the spawned server (with --spawn-server)."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--users", type=int, default=200, help="Simulated users")
+    parser.add_argument("--room-size", type=int, default=20, help="Users per room")
+    parser.add_argument("--messages", type=int, default=10, help="Messages each user sends")
+    parser.add_argument("--rate", type=float, default=2.0, help="Messages per second per user")
+    parser.add_argument("--concurrency", type=int, default=32, help="Auth handshakes in flight")
+    parser.add_argument("--server-pid", type=int, default=None, help="Server process to sample RSS from")
+    parser.add_argument(
+        "--spawn-server", choices=["threaded", "asyncio"], default=None,
+        help="Start a fresh server in this mode on --port for the run"
+    )
+    parser.add_argument(
+        "--encoding", choices=["plain", JSON_ENCODING, MSGPACK_ENCODING], default="plain",
+        help="Negotiate a tagged encoding instead of the plain format"
+    )
+    parser.add_argument("--compress", action="store_true", help="Also negotiate zlib compression")
+    parser.add_argument(
+        "--tls", action="store_true",
+        help="Connect over TLS (a spawned server gets a self-signed certificate)"
+    )
+    parser.add_argument("--ca-file", default=None, help="Certificate to trust for --tls without --spawn-server")
+    parser.add_argument(
+        "--connection-rate", type=int, default=None, metavar="N",
+        help="Instead of the chat load, time N bare connections; with --spawn-server "
+             "this compares plaintext with full and resumed TLS handshakes"
+    )
+    parser.add_argument("--output", default=None, help="Write JSON results here instead of stdout")
+    args, server_args = parser.parse_known_args()
+
+    raise_fd_limit()
+    workdir = tempfile.mkdtemp(prefix="chat-bench-")
+    if args.connection_rate:
+        results = compare_connection_rates(args, server_args, workdir)
+    else:
+        results = run_load(args, server_args, workdir)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+        print(f"📊 Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
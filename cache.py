@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+class CredentialCache:
+    """LRU + TTL cache of username -> (user_id, password_hash).
+
+    Sits in front of the users table so reconnect storms are answered from
+    memory. Unknown usernames are cached too (negative entries, shorter TTL)
+    so repeated bad logins don't hit the database either. Writers must call
+    put()/invalidate() whenever a user row changes to keep it coherent.
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0, negative_ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # username -> (credentials or None, expires_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        """Return (found, credentials); credentials is None for a known-missing user"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self.entries[username]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(username)
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[0]
+
+    def put(self, username, user_id, password_hash):
+        self._store(username, (user_id, password_hash), self.ttl)
+
+    def put_missing(self, username):
+        """Remember that a username does not exist"""
+        self._store(username, None, self.negative_ttl)
+
+    def _store(self, username, credentials, ttl):
+        with self.lock:
+            self.entries[username] = (credentials, time.monotonic() + ttl)
+            self.entries.move_to_end(username)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, username):
+        with self.lock:
+            self.entries.pop(username, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "size": len(self.entries)
+            }
@@ -0,0 +1,91 @@
+import threading
+from protocol import PLAIN_CODEC
+
+class ClientState:
+    """Everything the server keeps per connection, in one compact object"""
+
+    __slots__ = ("conn", "addr", "username", "outbound", "codec", "acks_mail", "held", "deferred")
+
+    def __init__(self, conn, addr=None):
+        self.conn = conn          # socket (threaded) or StreamWriter (asyncio)
+        self.addr = addr
+        self.username = None      # set once authenticated
+        self.outbound = None      # OutboundQueue / AsyncOutboundQueue
+        self.codec = PLAIN_CODEC  # replaced after hello negotiation
+        self.acks_mail = False    # client sends mailbox_ack (asked for in hello)
+        self.held = None          # frames queued behind a reply being fetched
+        self.deferred = None      # replies to finish before the next line is read
+
+class ConnectionRegistry:
+    """Open connections and their ClientState, safe to use from any thread.
+
+    add/authenticate/remove are O(1) dict updates under a short lock.
+    Lookups by connection take no lock at all. Fan-out over everyone
+    iterates an immutable snapshot tuple that is rebuilt at most once per
+    change (an epoch): mutations only invalidate it, so connection churn
+    never costs a copy, and a broadcast never sees a half-updated set.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}         # connection -> ClientState
+        self.authenticated = {}  # connection -> ClientState, logged-in only
+        self._all = None         # cached snapshots, None when stale
+        self._authenticated = None
+
+    def add(self, conn, addr=None):
+        state = ClientState(conn, addr)
+        with self.lock:
+            self.states[conn] = state
+            self._all = None
+        return state
+
+    def get(self, conn):
+        return self.states.get(conn)
+
+    def authenticate(self, conn, username):
+        """Mark a connection as logged in as username"""
+        with self.lock:
+            state = self.states.get(conn)
+            if state is None:
+                return None
+            state.username = username
+            self.authenticated[conn] = state
+            self._authenticated = None
+            return state
+
+    def remove(self, conn):
+        """Forget a connection; returns its state, or None if already gone"""
+        with self.lock:
+            state = self.states.pop(conn, None)
+            if state is None:
+                return None
+            self._all = None
+            if self.authenticated.pop(conn, None) is not None:
+                self._authenticated = None
+            return state
+
+    def snapshot(self):
+        """Every ClientState as of now, as an immutable tuple"""
+        snapshot = self._all
+        if snapshot is None:
+            with self.lock:
+                snapshot = self._all = tuple(self.states.values())
+        return snapshot
+
+    def authenticated_connections(self):
+        """Every logged-in connection as of now, as an immutable tuple"""
+        snapshot = self._authenticated
+        if snapshot is None:
+            with self.lock:
+                snapshot = self._authenticated = tuple(self.authenticated)
+        return snapshot
+
+    def authenticated_count(self):
+        return len(self.authenticated)
+
+    def __contains__(self, conn):
+        return conn in self.states
+
+    def __len__(self):
+        return len(self.states)
@@ -1,18 +1,31 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import bindparam, case, create_engine, delete, event, func, inspect, insert, select, text, Column, Index, Integer, String, Text, DateTime
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
-import bcrypt
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from datetime import datetime, timedelta
+import logging
+import os
+import time
+import metrics
+from cache import CredentialCache
+from hashing import HasherBusy, PasswordHasher
+from rooms import DEFAULT_ROOM
+
+logger = logging.getLogger("chat.db")
 
 # Create base class for models
 Base = declarative_base()
 
+MAX_USERNAME_CHARS = 50  # Width of the username columns
+
 class User(Base):
     """User model for the chat application"""
     __tablename__ = 'users'
     
     id = Column(Integer, primary_key=True)
-    username = Column(String(50), unique=True, nullable=False)
+    username = Column(String(MAX_USERNAME_CHARS), unique=True, nullable=False)
     password_hash = Column(String(128), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login = Column(DateTime)
@@ -20,38 +33,221 @@ class User(Base):
     def __repr__(self):
         return f"<User(username='{self.username}')>"
 
+class Message(Base):
+    """Chat message kept for history replay"""
+    __tablename__ = 'messages'
+    
+    # Append-only: the primary key doubles as the replay index
+    id = Column(Integer, primary_key=True)
+    room = Column(String(32), nullable=False, default=DEFAULT_ROOM, server_default=DEFAULT_ROOM)
+    username = Column(String(MAX_USERNAME_CHARS), nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Replay reads "last N messages of a room": one range scan on this index
+    __table_args__ = (Index("ix_messages_room_id", "room", "id"),)
+    
+    def __repr__(self):
+        return f"<Message(username='{self.username}', id={self.id})>"
+
+class MailboxEntry(Base):
+    """Direct message waiting for a user who was offline when it was sent"""
+    __tablename__ = 'mailbox'
+    
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String(MAX_USERNAME_CHARS), nullable=False)
+    sender = Column(String(MAX_USERNAME_CHARS), nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Delivery reads one recipient's mail in id order; retention deletes by age
+    __table_args__ = (
+        Index("ix_mailbox_recipient_id", "recipient", "id"),
+        Index("ix_mailbox_created_at", "created_at"),
+    )
+    
+    def __repr__(self):
+        return f"<MailboxEntry(recipient='{self.recipient}', id={self.id})>"
+
+DEFAULT_DB_URL = os.environ.get("CHAT_DB_URL", "sqlite:///chat_users.db")
+
+def validate_credentials(username, password):
+    """Registration rules; returns the reason a new account is refused, or None"""
+    if not username or not password:
+        return "Username and password cannot be empty"
+    if len(username) < 3:
+        return "Username must be at least 3 characters long"
+    if len(username) > MAX_USERNAME_CHARS:
+        return f"Username must be at most {MAX_USERNAME_CHARS} characters long"
+    if len(password) < 6:
+        return "Password must be at least 6 characters long"
+    return None
+
+def create_db_engine(db_url, pool_size=10, max_overflow=20, busy_timeout=5.0):
+    """Create an engine tuned for many concurrent short auth queries.
+
+    SQLite gets WAL journaling (readers no longer block the writer), a busy
+    timeout instead of instant "database is locked" errors, and connections
+    that may be used from any thread. Server databases (PostgreSQL, MySQL,
+    ...) get a sized connection pool with pre-ping.
+    """
+    url = make_url(db_url)
+    
+    if url.get_backend_name() != "sqlite":
+        return instrument_engine(create_engine(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=1800
+        ))
+    
+    in_memory = url.database in (None, "", ":memory:")
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": busy_timeout},
+        # A private in-memory database only exists on a single connection
+        poolclass=StaticPool if in_memory else None,
+        **({} if in_memory else {"pool_size": pool_size, "max_overflow": max_overflow})
+    )
+    
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not in_memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        cursor.close()
+    
+    return instrument_engine(engine)
+
+def instrument_engine(engine):
+    """Record every statement's execution time in chat_db_query_seconds"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+    
+    @event.listens_for(engine, "after_cursor_execute")
+    def _record_query_time(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.DB_QUERY_SECONDS.observe(elapsed, statement=statement.split(None, 1)[0].upper())
+    
+    return engine
+
+def init_schema(engine):
+    """Create missing tables and add columns introduced after a database
+    file was first created. Returns True if the database has a full-text
+    message index."""
+    Base.metadata.create_all(engine)
+    
+    columns = {column["name"] for column in inspect(engine).get_columns("messages")}
+    if "room" not in columns:
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"ALTER TABLE messages ADD COLUMN room VARCHAR(32) NOT NULL DEFAULT '{DEFAULT_ROOM}'"
+            ))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_messages_room_id ON messages (room, id)"
+            ))
+    
+    return engine.dialect.name == "sqlite" and init_search_index(engine)
+
+def init_search_index(engine):
+    """Create the FTS5 index over message content and fill it from history.
+
+    It is an external-content table (the text lives only in messages) that
+    save_messages() extends batch by batch; message_search_state records
+    the last message id indexed. Returns False if SQLite lacks FTS5.
+    """
+    with engine.begin() as connection:
+        if connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first():
+            return True
+        try:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE messages_fts USING fts5(content, content='messages', content_rowid='id')"
+            ))
+        except OperationalError:
+            logger.warning("⚠️ SQLite has no FTS5, /search falls back to an in-memory index")
+            return False
+        connection.execute(text(
+            "CREATE TABLE message_search_state (id INTEGER PRIMARY KEY CHECK (id = 1), indexed_up_to INTEGER NOT NULL)"
+        ))
+        connection.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+        connection.execute(text(
+            "INSERT INTO message_search_state VALUES (1, (SELECT COALESCE(MAX(id), 0) FROM messages))"
+        ))
+    return True
+
+def prepare_database(db_url=DEFAULT_DB_URL):
+    """Create the schema up front, e.g. before forking worker processes
+    that would otherwise race each other doing it"""
+    engine = create_db_engine(db_url)
+    try:
+        init_schema(engine)
+    finally:
+        engine.dispose()
+
 class DatabaseHandler:
-    def __init__(self, db_path="sqlite:///chat_users.db"):
-        """Initialize database with SQLAlchemy"""
-        self.engine = create_engine(db_path)
-        Base.metadata.create_all(self.engine)
+    def __init__(self, db_path=DEFAULT_DB_URL, hasher=None, pool_size=10, max_overflow=20, cache=None,
+                 on_user_changed=None):
+        """Initialize database with SQLAlchemy.
+
+        on_user_changed, if given, is called with a username after this
+        handler created or modified that user, so other processes sharing
+        the database can drop their cached credentials.
+        """
+        self.hasher = hasher or PasswordHasher()
+        self.cache = cache or CredentialCache()
+        self.on_user_changed = on_user_changed
+        self.pool_size = pool_size
+        self.engine = create_db_engine(db_path, pool_size=pool_size, max_overflow=max_overflow)
+        self.full_text_search = init_schema(self.engine)
+        
+        # Thread-local sessions: every client handler thread (or executor
+        # worker) gets its own session, and release_session() hands the
+        # connection back to the pool between requests
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+        
+        logger.info("✅ Database initialized with SQLAlchemy")
+    
+    def release_session(self):
+        """Close this thread's session and return its connection to the pool"""
+        self.session.remove()
+    
+    def lookup_credentials(self, username):
+        """Return (user_id, password_hash) for a username, or None if unknown.
+
+        Served from the credential cache when possible; misses fall through
+        to the database and populate the cache, including negative entries.
+        """
+        found, credentials = self.cache.get(username)
+        if found:
+            return credentials
         
-        # Create session factory
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        row = self.session.query(User.id, User.password_hash).filter_by(username=username).first()
+        if row is None:
+            self.cache.put_missing(username)
+            return None
         
-        print("✅ Database initialized with SQLAlchemy")
+        self.cache.put(username, row.id, row.password_hash)
+        return row.id, row.password_hash
     
     def register_user(self, username, password):
         """Register a new user with hashed password"""
         try:
             # Validate input
-            if not username or not password:
-                return False, "Username and password cannot be empty"
-            
-            if len(username) < 3:
-                return False, "Username must be at least 3 characters long"
-            
-            if len(password) < 6:
-                return False, "Password must be at least 6 characters long"
+            error = validate_credentials(username, password)
+            if error:
+                return False, error
             
             # Check if user already exists
-            existing_user = self.session.query(User).filter_by(username=username).first()
-            if existing_user:
+            if self.lookup_credentials(username):
                 return False, "Username already exists"
             
-            # Hash the password
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            # Hash the password without holding a pooled connection
+            self.release_session()
+            password_hash = self.hasher.hash_password(password)
             
             # Create new user
             new_user = User(
@@ -61,59 +257,108 @@ class DatabaseHandler:
             
             # Add and commit to database
             self.session.add(new_user)
+            self.session.flush()
+            user_id = new_user.id
             self.session.commit()
+            self.cache.put(username, user_id, password_hash)
+            self.user_changed(username)
             
-            print(f"✅ User '{username}' registered successfully")
+            logger.debug(f"✅ User '{username}' registered successfully")
             return True, "Registration successful"
             
+        except IntegrityError:
+            # Lost a race with a concurrent registration of the same name
+            self.session.rollback()
+            self.cache.invalidate(username)
+            return False, "Username already exists"
+        except HasherBusy:
+            return False, "Server busy, please try again shortly"
         except Exception as e:
             self.session.rollback()
-            print(f"❌ Registration error: {e}")
+            logger.error(f"❌ Registration error: {e}")
             return False, "Registration failed"
+        finally:
+            self.release_session()
     
     def authenticate_user(self, username, password):
         """Authenticate user login"""
         try:
             # Find user by username
-            user = self.session.query(User).filter_by(username=username).first()
+            credentials = self.lookup_credentials(username)
             
-            if not user:
+            if not credentials:
                 return False, "Username not found"
             
-            # Verify password
-            if bcrypt.checkpw(password.encode('utf-8'), user.password_hash):
-                # Update last login
-                user.last_login = datetime.utcnow()
-                self.session.commit()
-                
-                print(f"✅ User '{username}' authenticated successfully")
+            _, password_hash = credentials
+            
+            # Verify password without holding a pooled connection
+            self.release_session()
+            if self.hasher.check_password(password, password_hash):
+                # last_login is written later in a batch by the presence service
+                logger.debug(f"✅ User '{username}' authenticated successfully")
                 return True, "Login successful"
             else:
                 return False, "Invalid password"
                 
+        except HasherBusy:
+            return False, "Server busy, please try again shortly"
         except Exception as e:
-            print(f"❌ Authentication error: {e}")
+            self.session.rollback()
+            logger.error(f"❌ Authentication error: {e}")
             return False, "Authentication failed"
+        finally:
+            self.release_session()
+    
+    def change_password(self, username, new_password):
+        """Replace a user's password hash and drop the stale cache entry"""
+        try:
+            if not new_password or len(new_password) < 6:
+                return False, "Password must be at least 6 characters long"
+            
+            password_hash = self.hasher.hash_password(new_password)
+            updated = self.session.query(User).filter_by(username=username).update(
+                {User.password_hash: password_hash}
+            )
+            self.session.commit()
+            self.cache.invalidate(username)
+            self.user_changed(username)
+            
+            if not updated:
+                return False, "Username not found"
+            return True, "Password changed"
+            
+        except HasherBusy:
+            return False, "Server busy, please try again shortly"
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"❌ Password change error: {e}")
+            return False, "Password change failed"
+        finally:
+            self.release_session()
+    
+    def user_changed(self, username):
+        if self.on_user_changed is not None:
+            self.on_user_changed(username)
     
     def user_exists(self, username):
         """Check if username exists"""
         try:
-            user = self.session.query(User).filter_by(username=username).first()
-            return user is not None
+            return self.lookup_credentials(username) is not None
         except Exception as e:
-            print(f"❌ Database error: {e}")
+            logger.error(f"❌ Database error: {e}")
             return False
+        finally:
+            self.release_session()
     
     def get_user_stats(self):
-        """Get basic user statistics"""
+        """Get basic user statistics from one aggregate query"""
         try:
-            total_users = self.session.query(User).count()
-            
-            # Get recent registrations (last 7 days)
-            week_ago = datetime.utcnow().replace(day=datetime.utcnow().day - 7)
-            recent_users = self.session.query(User).filter(
-                User.created_at >= week_ago
-            ).count()
+            # Recent registrations: the last 7 days
+            week_ago = datetime.utcnow() - timedelta(days=7)
+            total_users, recent_users = self.session.query(
+                func.count(User.id),
+                func.count(case((User.created_at >= week_ago, 1)))
+            ).one()
             
             return {
                 "total_users": total_users,
@@ -121,23 +366,273 @@ class DatabaseHandler:
             }
             
         except Exception as e:
-            print(f"❌ Stats error: {e}")
+            logger.error(f"❌ Stats error: {e}")
             return {"total_users": 0, "recent_users": 0}
+        finally:
+            self.release_session()
     
     def get_all_users(self):
-        """Get all users (for admin purposes)"""
+        """Get all users (for admin purposes); iter_users() streams instead"""
+        try:
+            return [(row.username, row.created_at) for row in self.iter_users()]
+        except Exception as e:
+            logger.error(f"❌ Error fetching users: {e}")
+            return []
+    
+    def iter_users(self, after=None, limit=None, batch_size=1000):
+        """Yield users in username order without loading the whole table.
+
+        Rows (username, password_hash, created_at, last_login) are fetched
+        batch_size at a time on a connection of their own, as plain rows
+        rather than ORM objects. after (a username) and limit page through
+        the listing by key, so later pages cost no more than the first.
+        """
+        query = select(User.username, User.password_hash, User.created_at, User.last_login).order_by(User.username)
+        if after is not None:
+            query = query.where(User.username > after)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.engine.connect() as connection:
+            yield from connection.execution_options(yield_per=batch_size).execute(query)
+    
+    def existing_usernames(self, usernames):
+        """The subset of usernames that are already registered"""
+        try:
+            rows = self.session.query(User.username).filter(User.username.in_(usernames))
+            return {row.username for row in rows}
+        finally:
+            self.release_session()
+    
+    def insert_users(self, rows):
+        """Insert a batch of already-hashed users in one transaction.
+
+        rows are dicts with username, password_hash, created_at and
+        last_login. Usernames that already exist are skipped. Returns the
+        number of users inserted, or None if the batch failed.
+        """
+        try:
+            unique = {}
+            for row in rows:
+                unique.setdefault(row["username"], row)  # First one wins
+            existing = {
+                row.username for row in
+                self.session.query(User.username).filter(User.username.in_(list(unique)))
+            }
+            rows = [row for username, row in unique.items() if username not in existing]
+            if rows:
+                self.session.execute(insert(User), rows)
+            self.session.commit()
+            for row in rows:
+                self.cache.invalidate(row["username"])
+                self.user_changed(row["username"])
+            return len(rows)
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"❌ User import error: {e}")
+            return None
+        finally:
+            self.release_session()
+    
+    def record_last_seen(self, last_seen):
+        """Write {username: datetime} into last_login with one executemany UPDATE"""
+        users = User.__table__
+        statement = (
+            users.update()
+            .where(users.c.username == bindparam("seen_username"))
+            .values(last_login=bindparam("seen_at"))
+        )
+        try:
+            self.session.execute(statement, [
+                {"seen_username": username, "seen_at": seen_at}
+                for username, seen_at in last_seen.items()
+            ])
+            self.session.commit()
+            return True
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"❌ Last-seen update error: {e}")
+            return False
+        finally:
+            self.release_session()
+    
+    def save_messages(self, rows):
+        """Insert a batch of message rows in a single transaction.
+
+        The full-text index is brought up to date in the same transaction
+        with one INSERT ... SELECT over the new rows, rather than a trigger
+        firing per row.
+        """
+        try:
+            self.session.execute(insert(Message), rows)
+            if self.full_text_search:
+                self.session.execute(text(
+                    "INSERT INTO messages_fts(rowid, content) SELECT id, content FROM messages "
+                    "WHERE id > (SELECT indexed_up_to FROM message_search_state)"
+                ))
+                self.session.execute(text(
+                    "UPDATE message_search_state SET indexed_up_to = (SELECT MAX(id) FROM messages)"
+                ))
+            self.session.commit()
+            return True
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"❌ Message batch error: {e}")
+            return False
+        finally:
+            self.release_session()
+    
+    def recent_messages(self, room=DEFAULT_ROOM, limit=50):
+        """Last `limit` messages of a room (None: of all rooms), oldest first,
+        from one indexed range query"""
+        try:
+            query = self.session.query(Message.room, Message.username, Message.content, Message.created_at)
+            if room is not None:
+                query = query.filter(Message.room == room)
+            rows = query.order_by(Message.id.desc()).limit(limit).all()
+            return [
+                {"room": row.room, "username": row.username, "content": row.content, "created_at": row.created_at}
+                for row in reversed(rows)
+            ]
+        except Exception as e:
+            logger.error(f"❌ Error fetching messages: {e}")
+            return []
+        finally:
+            self.release_session()
+    
+    def search_messages(self, terms, room=None, username=None, before=None, limit=10, scan=5000):
+        """Newest messages containing every term, via the FTS5 index.
+
+        Only the newest `scan` index hits below `before` (a message id) are
+        examined, so a rarely matching room/user filter cannot turn one
+        query into a walk over the whole history. Returns (rows newest
+        first, next_before); next_before continues the search, None when
+        nothing older can match.
+        """
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        hits = (
+            "SELECT rowid AS id FROM messages_fts WHERE messages_fts MATCH :match"
+            + (" AND rowid < :before" if before is not None else "")
+            + " ORDER BY rowid DESC LIMIT :scan"
+        )
+        filters = "".join([
+            " AND m.room = :room" if room is not None else "",
+            " AND m.username = :username" if username is not None else "",
+        ])
+        params = {"match": match, "before": before, "scan": scan, "room": room, "username": username, "limit": limit}
+        try:
+            rows = self.session.execute(text(
+                f"SELECT m.id, m.room, m.username, m.content, m.created_at FROM ({hits}) AS hits "
+                f"JOIN messages m ON m.id = hits.id WHERE 1 = 1{filters} ORDER BY m.id DESC LIMIT :limit"
+            ).columns(created_at=DateTime), params).all()
+            results = [
+                {"id": row.id, "room": row.room, "username": row.username, "content": row.content,
+                 "created_at": row.created_at}
+                for row in rows
+            ]
+            if len(results) == limit:
+                return results, results[-1]["id"]
+            scanned, oldest = self.session.execute(
+                text(f"SELECT COUNT(*), MIN(id) FROM ({hits}) AS hits"), params
+            ).one()
+            return results, (oldest if scanned == scan else None)
+        except Exception as e:
+            logger.error(f"❌ Search error: {e}")
+            return [], None
+        finally:
+            self.release_session()
+    
+    def save_mail(self, rows):
+        """Insert a batch of mailbox rows (recipient, sender, content,
+        created_at) in a single transaction"""
+        try:
+            self.session.execute(insert(MailboxEntry), rows)
+            self.session.commit()
+            return True
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"❌ Mailbox batch error: {e}")
+            return False
+        finally:
+            self.release_session()
+    
+    def fetch_mail(self, recipient, limit=500):
+        """A user's newest `limit` waiting messages, oldest first, from one
+        indexed range query"""
         try:
-            users = self.session.query(User).all()
-            return [(user.username, user.created_at) for user in users]
+            rows = (
+                self.session.query(MailboxEntry.id, MailboxEntry.sender, MailboxEntry.content, MailboxEntry.created_at)
+                .filter(MailboxEntry.recipient == recipient)
+                .order_by(MailboxEntry.id.desc())
+                .limit(limit)
+                .all()
+            )
+            return [
+                {"id": row.id, "sender": row.sender, "content": row.content, "created_at": row.created_at}
+                for row in reversed(rows)
+            ]
         except Exception as e:
-            print(f"❌ Error fetching users: {e}")
+            logger.error(f"❌ Error fetching mailbox: {e}")
             return []
+        finally:
+            self.release_session()
+    
+    def ack_mail(self, acks):
+        """Delete delivered mail, {recipient: highest delivered id}, with one
+        executemany DELETE"""
+        mailbox = MailboxEntry.__table__
+        statement = mailbox.delete().where(
+            mailbox.c.recipient == bindparam("ack_recipient"),
+            mailbox.c.id <= bindparam("ack_id")
+        )
+        try:
+            self.session.execute(statement, [
+                {"ack_recipient": recipient, "ack_id": up_to}
+                for recipient, up_to in acks.items()
+            ])
+            self.session.commit()
+            return True
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"❌ Mailbox ack error: {e}")
+            return False
+        finally:
+            self.release_session()
+    
+    def compact_mailbox(self, cutoff, max_per_user):
+        """Delete mail older than cutoff and all but each user's newest
+        max_per_user messages; returns how many rows went, or None"""
+        ranked = select(
+            MailboxEntry.id,
+            func.row_number().over(
+                partition_by=MailboxEntry.recipient, order_by=MailboxEntry.id.desc()
+            ).label("rank")
+        ).subquery()
+        try:
+            expired = self.session.execute(
+                delete(MailboxEntry).where(MailboxEntry.created_at < cutoff),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+            overflow = self.session.execute(
+                delete(MailboxEntry).where(
+                    MailboxEntry.id.in_(select(ranked.c.id).where(ranked.c.rank > max_per_user))
+                ),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+            self.session.commit()
+            return expired + overflow
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"❌ Mailbox compaction error: {e}")
+            return None
+        finally:
+            self.release_session()
     
     def close(self):
-        """Close database session"""
-        if self.session:
-            self.session.close()
-            print("🔒 Database session closed")
+        """Close database sessions and the connection pool"""
+        self.hasher.shutdown()
+        self.release_session()
+        self.engine.dispose()
+        logger.info("🔒 Database session closed")
 
 # Test the database functionality
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import logging
+import os
+import socket
+import threading
+
+logger = logging.getLogger("chat.server")
+
+GREETING = b"listener"  # Followed by the session token secret
+
+class ListenerHandoff:
+    """Hands the listening socket to a replacement server (zero-downtime restart).
+
+    The running server waits on a Unix socket at `path`. A successor
+    started with --take-over connects, receives the listening socket's file
+    descriptor (SCM_RIGHTS via socket.send_fds) and starts accepting on the
+    very same socket, so no connection is refused while the old process
+    drains its clients. The session token secret travels with it, so the
+    successor accepts the tokens its clients resume with. Only the owner
+    may connect to the handoff socket.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.server = None
+        self.secret = b""
+
+    def offer(self, listen_socket, on_handoff, secret=b""):
+        """Serve the listening socket to one successor, then call on_handoff()"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left by the process we took over from
+        self.secret = secret
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        os.chmod(self.path, 0o600)  # It hands out the listener and the secret
+        self.server.listen(1)
+        threading.Thread(target=self.run, args=(listen_socket, on_handoff), daemon=True).start()
+
+    def run(self, listen_socket, on_handoff):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return  # Closed by close()
+            with conn:
+                try:
+                    conn.settimeout(10)
+                    socket.send_fds(conn, [GREETING + self.secret], [listen_socket.fileno()])
+                    if conn.recv(16) != b"ok":
+                        continue
+                except OSError as e:
+                    logger.warning(f"⚠️ Listener handoff failed: {e}")
+                    continue
+            # The successor may already have bound a new handoff socket at
+            # our path, so close ours without unlinking it
+            self.server.close()
+            self.server = None
+            logger.info("🤝 Listening socket handed to the new server, draining")
+            on_handoff()
+            return
+
+    def close(self):
+        """Stop offering; removes the socket file unless a successor owns it now"""
+        if self.server is None:
+            return
+        self.server.close()
+        self.server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+def take_over(path, timeout=10.0):
+    """Receive the listening socket of the server offering it at `path`.
+
+    Returns (listen_socket, secret); secret is the predecessor's session
+    token secret, or None if it did not send one.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(path)
+        data, fds, _, _ = socket.recv_fds(conn, 65536, 1)
+        if not fds:
+            raise OSError(f"No listening socket received from {path}")
+        listen_socket = socket.socket(fileno=fds[0])
+        conn.sendall(b"ok")
+    secret = data[len(GREETING):] if data.startswith(GREETING) else b""
+    return listen_socket, secret or None
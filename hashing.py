@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bcrypt
+import metrics
+
+POOL_KINDS = ("thread", "process")
+
+class HasherBusy(Exception):
+    """Raised when too many hash jobs are already waiting for a worker"""
+
+# Module-level so they can be pickled into a process pool
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _checkpw(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+class PasswordHasher:
+    """Runs bcrypt on a worker pool with a bounded backlog.
+
+    bcrypt is deliberately slow (~100ms per call), so running it inline on
+    connection handlers lets a login storm freeze everything else. Jobs go
+    to a thread pool (bcrypt releases the GIL) or a process pool, and once
+    max_pending jobs are queued new ones fail fast with HasherBusy.
+    """
+
+    def __init__(self, workers=4, kind="thread", max_pending=64, rounds=12):
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Unknown hash pool kind: {kind}")
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.rounds = rounds
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, func, *args):
+        """Queue a hash job, returning a Future; raises HasherBusy when full"""
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy("Too many pending password hashes")
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def hash_password(self, password):
+        """Hash a password on the pool and wait for the result"""
+        with metrics.BCRYPT_SECONDS.time(operation="hash"):
+            return self.submit(_hashpw, password.encode('utf-8'), self.rounds).result()
+
+    def hash_passwords(self, passwords):
+        """Hash a batch of passwords in parallel across the pool, in order.
+
+        Meant for bulk imports on a process pool; the whole batch must fit
+        within max_pending.
+        """
+        with metrics.BCRYPT_SECONDS.time(operation="hash_batch"):
+            futures = [self.submit(_hashpw, password.encode('utf-8'), self.rounds) for password in passwords]
+            return [future.result() for future in futures]
+
+    def check_password(self, password, password_hash):
+        """Verify a password on the pool and wait for the result"""
+        with metrics.BCRYPT_SECONDS.time(operation="check"):
+            return self.submit(_checkpw, password.encode('utf-8'), password_hash).result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
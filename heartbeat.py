@@ -0,0 +1,122 @@
+import math
+import socket
+import threading
+import time
+
+def enable_keepalive(sock, idle=60, interval=10, count=5):
+    """Turn on TCP keepalive so the kernel notices peers that vanished.
+
+    idle: seconds of silence before the first probe, interval: seconds
+    between probes, count: unanswered probes before the connection is
+    reset. Options the platform lacks are skipped.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    options = (
+        (getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None)), idle),
+        (getattr(socket, "TCP_KEEPINTVL", None), interval),
+        (getattr(socket, "TCP_KEEPCNT", None), count),
+    )
+    for option, value in options:
+        if option is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, option, value)
+            except OSError:
+                pass
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule/cancel, one slot swept per tick.
+
+    Delays longer than the wheel are clamped to its span; callers that
+    check real timestamps on expiry simply reschedule.
+    """
+
+    def __init__(self, tick=1.0, slots=128):
+        self.tick = tick
+        self.slots = [set() for _ in range(max(slots, 2))]
+        self.slot_of = {}  # key -> slot index
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def schedule(self, key, delay):
+        ticks = min(max(math.ceil(delay / self.tick), 1), len(self.slots) - 1)
+        with self.lock:
+            previous = self.slot_of.get(key)
+            if previous is not None:
+                self.slots[previous].discard(key)
+            index = (self.position + ticks) % len(self.slots)
+            self.slots[index].add(key)
+            self.slot_of[key] = index
+
+    def cancel(self, key):
+        with self.lock:
+            index = self.slot_of.pop(key, None)
+            if index is not None:
+                self.slots[index].discard(key)
+
+    def advance(self):
+        """Move one tick forward and return the keys that expired"""
+        with self.lock:
+            self.position = (self.position + 1) % len(self.slots)
+            expired = self.slots[self.position]
+            self.slots[self.position] = set()
+            for key in expired:
+                del self.slot_of[key]
+        return expired
+
+    def __len__(self):
+        return len(self.slot_of)
+
+class Heartbeats:
+    """Decides which connections to ping and which to reap as dead.
+
+    Receiving a frame only stamps the connection's last activity (a dict
+    store); the timer wheel holds one entry per connection, due when it
+    would next need attention. On expiry the entry is re-armed from the
+    real timestamp, a quiet connection gets one ping, and one silent for
+    idle_timeout is reaped. Connections whose protocol cannot answer
+    pings can be exempted and are left to TCP keepalive.
+    """
+
+    def __init__(self, ping_interval=30.0, idle_timeout=90.0, tick=1.0):
+        self.ping_interval = ping_interval
+        self.idle_timeout = max(idle_timeout, ping_interval)
+        self.tick = tick
+        self.wheel = TimerWheel(tick, math.ceil(self.idle_timeout / tick) + 2)
+        self.last_activity = {}  # connection -> monotonic time of last frame
+
+    def add(self, conn):
+        self.last_activity[conn] = time.monotonic()
+        self.wheel.schedule(conn, self.ping_interval)
+
+    def touch(self, conn):
+        """Record inbound traffic; called for every received frame"""
+        self.last_activity[conn] = time.monotonic()
+
+    def exempt(self, conn):
+        """Never ping or reap this connection (it cannot answer pings)"""
+        self.wheel.cancel(conn)
+
+    def remove(self, conn):
+        self.last_activity.pop(conn, None)
+        self.wheel.cancel(conn)
+
+    def due(self):
+        """Advance one tick; returns (connections to ping, connections to reap)"""
+        now = time.monotonic()
+        to_ping, to_reap = [], []
+        for conn in self.wheel.advance():
+            last = self.last_activity.get(conn)
+            if last is None:
+                continue  # Removed while being rescheduled
+            idle = now - last
+            if idle >= self.idle_timeout:
+                to_reap.append(conn)
+            elif idle >= self.ping_interval:
+                to_ping.append(conn)
+                self.wheel.schedule(conn, self.idle_timeout - idle)
+            else:
+                self.wheel.schedule(conn, self.ping_interval - idle)
+        return to_ping, to_reap
+
+    def __len__(self):
+        return len(self.wheel)
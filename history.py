@@ -0,0 +1,115 @@
+import logging
+import threading
+from datetime import datetime
+from rooms import DEFAULT_ROOM
+
+logger = logging.getLogger("chat.history")
+
+class BatchRetry:
+    """Retry budget for a writer thread's failed batches.
+
+    After a failed write, failed() says whether to put the batch back and
+    try again on the next flush; once max_attempts writes in a row have
+    failed it logs the loss and says to drop it instead.
+    """
+
+    def __init__(self, what, log, max_attempts=5):
+        self.what = what
+        self.log = log
+        self.max_attempts = max_attempts
+        self.failures = 0  # Consecutive failed writes
+
+    def succeeded(self):
+        self.failures = 0
+
+    def failed(self, count):
+        """Count a failed write of `count` rows; True to retry them"""
+        self.failures += 1
+        if self.failures < self.max_attempts:
+            return True
+        self.failures = 0
+        self.log.error(f"❌ Dropped {count} {self.what} after {self.max_attempts} failed attempts")
+        return False
+
+class MessageStore:
+    """Persists chat messages off the broadcast path with group commits.
+
+    append() only records the row in memory and wakes the writer thread;
+    the writer flushes everything that accumulated since the last flush in
+    one transaction, at most every flush_interval seconds (sooner once
+    batch_size rows are waiting). Replay merges the newest committed rows
+    with the ones still waiting to be written. on_saved, if given, is
+    called with every batch once it is committed. A batch that fails to
+    commit is put back in front of the pending rows and retried; after
+    max_attempts failures in a row it is dropped.
+    """
+
+    def __init__(self, db, batch_size=200, flush_interval=0.2, replay_size=50, on_saved=None, max_attempts=5):
+        self.db = db
+        self.retry = BatchRetry("chat messages", logger, max_attempts)
+        self.on_saved = on_saved
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.replay_size = replay_size
+        self.pending = []
+        self.in_flight = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def append(self, username, content, room=DEFAULT_ROOM):
+        """Record a chat message; never touches the database"""
+        row = {"room": room, "username": username, "content": content, "created_at": datetime.utcnow()}
+        with self.lock:
+            self.pending.append(row)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.set()
+
+    def run(self):
+        """Writer loop: group-commit pending rows until closed"""
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+            if self.closed:
+                return
+
+    def flush(self):
+        """Write everything pending in one transaction"""
+        with self.lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+            self.in_flight = batch
+        saved = self.db.save_messages(batch)
+        retry = not saved and self.retry.failed(len(batch))
+        with self.lock:
+            self.in_flight = []
+            if retry:
+                self.pending = batch + self.pending  # Still replayed, retried next flush
+        if saved:
+            self.retry.succeeded()
+            if self.on_saved is not None:
+                self.on_saved(batch)
+
+    def recent(self, room=DEFAULT_ROOM, limit=None):
+        """The last `limit` messages of a room, including ones not yet committed"""
+        limit = limit or self.replay_size
+        with self.lock:
+            unflushed = [row for row in self.in_flight + self.pending if row["room"] == room]
+        rows = self.db.recent_messages(room, limit)
+
+        # A batch that committed after the snapshot shows up in both lists;
+        # anything not newer than the last committed row is a duplicate
+        if rows and unflushed:
+            newest = rows[-1]["created_at"]
+            unflushed = [row for row in unflushed if row["created_at"] > newest]
+        return (rows + unflushed)[-limit:]
+
+    def close(self):
+        """Flush what is left and stop the writer"""
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join(timeout=5)
@@ -0,0 +1,43 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+_listener = None
+
+def setup_logging(level="info", stream=None):
+    """Route all logging through a queue drained by a background thread.
+
+    Callers only pay for putting a record on an in-memory queue; the
+    formatting and the (possibly slow) write to stdout happen on the
+    listener thread, so logging never blocks a client handler or the
+    event loop. Per-message logs are DEBUG, so the default INFO level
+    keeps the chat hot path free of log I/O altogether.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter("%(message)s"))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level.upper())
+    _listener.start()
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
@@ -0,0 +1,268 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Seconds; wide enough for both a cached lookup and a slow bcrypt round
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FANOUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base for metrics with an optional fixed set of label names"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self):
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        if not items and not self.label_names:
+            items = [((), 0)]
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Metric):
+    """A value that goes up and down, set directly or sampled on scrape"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self.current = 0
+        self.function = None
+
+    def set(self, value):
+        self.current = value
+
+    def set_function(self, function):
+        """Compute the value only when scraped (e.g. from live server state)"""
+        self.function = function
+
+    def samples(self):
+        value = self.current
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float("nan")
+        return [f"{self.name} {_format_value(value)}"]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of a with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        if not items and not self.label_names:
+            items = [((), [0] * (len(self.buckets) + 2))]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+class Registry:
+    """Collection of metrics rendered together in Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text):
+        return self.register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Process-wide metrics, updated from the server, database and hashing code
+CONNECTIONS = REGISTRY.counter("chat_connections_total", "TCP connections accepted")
+CONNECTED_CLIENTS = REGISTRY.gauge("chat_connected_clients", "Open client connections")
+AUTHENTICATED_CLIENTS = REGISTRY.gauge("chat_authenticated_clients", "Connections past authentication")
+AUTH_ATTEMPTS = REGISTRY.counter("chat_auth_attempts_total", "Login/register/resume requests", ["kind"])
+AUTH_FAILURES = REGISTRY.counter("chat_auth_failures_total", "Auth requests that were refused", ["kind"])
+BCRYPT_SECONDS = REGISTRY.histogram(
+    "chat_bcrypt_seconds", "bcrypt time including the wait for a pool worker", ["operation"]
+)
+DB_QUERY_SECONDS = REGISTRY.histogram("chat_db_query_seconds", "Database statement time", ["statement"])
+BROADCAST_SECONDS = REGISTRY.histogram("chat_broadcast_seconds", "Time to encode and queue one broadcast")
+BROADCAST_RECIPIENTS = REGISTRY.histogram(
+    "chat_broadcast_recipients", "Local recipients per broadcast", buckets=FANOUT_BUCKETS
+)
+MESSAGES = REGISTRY.counter("chat_messages_total", "Chat lines received from clients")
+MAILBOX_STORED = REGISTRY.counter("chat_mailbox_stored_total", "Direct messages kept for offline users")
+MAILBOX_DELIVERED = REGISTRY.counter("chat_mailbox_delivered_total", "Mailbox messages sent to users at login")
+RATE_LIMITED = REGISTRY.counter("chat_rate_limited_total", "Requests refused by a rate limit", ["kind"])
+OUTBOUND_QUEUED = REGISTRY.gauge("chat_outbound_queued_frames", "Frames waiting in all outbound queues")
+OUTBOUND_MAX_DEPTH = REGISTRY.gauge("chat_outbound_queue_depth_max", "Deepest single outbound queue")
+TLS_HANDSHAKES = REGISTRY.counter(
+    "chat_tls_handshakes_total", "TLS handshakes by result (full, resumed, failed)", ["result"]
+)
+TLS_HANDSHAKE_SECONDS = REGISTRY.histogram("chat_tls_handshake_seconds", "Server-side TLS handshake time")
+IDLE_REAPED = REGISTRY.counter("chat_idle_reaped_total", "Connections dropped after missing heartbeats")
+DROPPED_FRAMES = REGISTRY.counter("chat_outbound_dropped_frames_total", "Frames discarded for slow consumers")
+BYTES_IN = REGISTRY.counter("chat_bytes_in_total", "Bytes received from clients, framing included")
+BYTES_OUT = REGISTRY.counter("chat_bytes_out_total", "Bytes written to client sockets, framing included")
+WRITES = REGISTRY.counter("chat_socket_writes_total", "Socket writes issued by outbound writers")
+FRAMES_PER_WRITE = REGISTRY.histogram(
+    "chat_frames_per_write", "Frames coalesced into one socket write", buckets=FANOUT_BUCKETS
+)
+
+class MetricsServer:
+    """Serves a registry at /metrics on a local admin port (own thread).
+
+    /settings exposes runtime-tunable values: GET lists them as JSON and
+    POST /settings?name=value changes them. `settings` maps each name to a
+    (getter, setter) pair; setters receive the raw string and should raise
+    ValueError for values they refuse.
+    """
+
+    def __init__(self, host="127.0.0.1", port=9100, registry=REGISTRY, settings=None):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.settings = settings if settings is not None else {}
+        self.httpd = None
+
+    def current_settings(self):
+        return {name: getter() for name, (getter, _) in self.settings.items()}
+
+    def start(self):
+        registry = self.registry
+        admin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, status, body, content_type="application/json"):
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path == "/settings":
+                    self.reply(200, json.dumps(admin.current_settings()))
+                elif path in ("/metrics", "/"):
+                    self.reply(200, registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                if url.path != "/settings":
+                    self.send_error(404)
+                    return
+                for name, value in parse_qsl(url.query):
+                    if name not in admin.settings:
+                        self.reply(400, json.dumps({"error": f"Unknown setting {name}"}))
+                        return
+                    try:
+                        admin.settings[name][1](value)
+                    except ValueError as e:
+                        self.reply(400, json.dumps({"error": f"{name}: {e}"}))
+                        return
+                self.reply(200, json.dumps(admin.current_settings()))
+
+            def log_message(self, format, *args):
+                pass  # Scrapes every few seconds would flood the log
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from history import BatchRetry
+
+logger = logging.getLogger("chat.offline")
+
+class Mailbox:
+    """Durable per-user queue for direct messages to users who are offline.
+
+    append() only records the message in memory; a writer thread stores
+    everything waiting in one transaction every flush_interval seconds and
+    deletes acknowledged mail the same way, with one executemany DELETE.
+    Every compact_interval seconds it drops mail older than retention_days
+    and all but each user's newest max_per_user messages. A login costs
+    one indexed read (fetch()), however large the backlog. A batch that
+    fails to commit goes back to the front of the queue and is retried on
+    the next flush; after max_attempts failures in a row it is dropped.
+    Acks whose DELETE fails are kept and deleted on a later flush.
+    """
+
+    def __init__(self, db, max_per_user=500, retention_days=30.0, flush_interval=0.2,
+                 compact_interval=3600.0, max_attempts=5):
+        self.db = db
+        self.retry = BatchRetry("offline messages", logger, max_attempts)
+        self.max_per_user = max_per_user
+        self.retention = timedelta(days=retention_days)
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.next_compaction = time.monotonic()  # Catch up on startup
+        self.pending = []
+        self.acks = {}  # recipient -> highest delivered id, not yet deleted
+        self.lock = threading.Lock()
+        # Held while writing, so a login never reads around a batch in flight
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def append(self, recipient, sender, content):
+        """Keep a message for recipient; never touches the database"""
+        row = {"recipient": recipient, "sender": sender, "content": content, "created_at": datetime.utcnow()}
+        with self.lock:
+            self.pending.append(row)
+
+    def fetch(self, recipient):
+        """Everything waiting for a user, oldest first, with ids to ack"""
+        with self.write_lock:
+            with self.lock:
+                waiting = any(row["recipient"] == recipient for row in self.pending)
+                acked = self.acks.get(recipient, 0)
+            if waiting:
+                self.store_pending()  # Sent moments ago: it needs an id too
+            rows = self.db.fetch_mail(recipient, self.max_per_user)
+        # Acked but not deleted yet (e.g. another device just got them)
+        return [row for row in rows if row["id"] > acked]
+
+    def ack(self, recipient, up_to):
+        """Mark a user's mail up to this id as delivered"""
+        with self.lock:
+            if up_to > self.acks.get(recipient, 0):
+                self.acks[recipient] = up_to
+
+    def run(self):
+        """Writer loop: store, delete and compact until closed"""
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+            if self.closed:
+                return
+            if time.monotonic() >= self.next_compaction:
+                self.compact()
+
+    def store_pending(self):
+        with self.lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+        if self.db.save_mail(batch):
+            self.retry.succeeded()
+        elif self.retry.failed(len(batch)):
+            with self.lock:
+                self.pending = batch + self.pending  # Oldest first, retried next flush
+
+    def flush(self):
+        """Write new mail and delete acknowledged mail"""
+        with self.write_lock:
+            self.store_pending()
+            with self.lock:
+                acks, self.acks = self.acks, {}
+            if acks and not self.db.ack_mail(acks):
+                for recipient, up_to in acks.items():
+                    self.ack(recipient, up_to)  # Keeps the highest id per recipient
+
+    def compact(self):
+        """Apply the retention limits"""
+        self.next_compaction = time.monotonic() + self.compact_interval
+        deleted = self.db.compact_mailbox(datetime.utcnow() - self.retention, self.max_per_user)
+        if deleted:
+            logger.info(f"🧹 Mailbox compaction dropped {deleted} expired messages")
+
+    def close(self):
+        """Write what is left and stop the writer"""
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join(timeout=5)
@@ -0,0 +1,217 @@
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+import metrics
+from protocol import Compressible, encode_frame
+
+# What to do when a client's outbound queue is full
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+DEFAULT_QUEUE_SIZE = 256
+
+# Frames gathered into one writev; stays well under the usual IOV_MAX (1024)
+MAX_BATCH = 512
+
+class CoalesceWindow:
+    """Shared, runtime-adjustable delay for gathering frames into one write.
+
+    A writer that flushed less than `seconds` ago waits out the rest of the
+    window before its next write, so a burst of broadcasts to a connection
+    leaves in one syscall. An idle connection's first frame goes out at
+    once: the added latency is at most one window, and zero when quiet.
+    """
+
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+
+    def delay(self, last_flush, now):
+        """Seconds to wait before the next write, given the last flush time"""
+        if self.seconds <= 0:
+            return 0
+        return max(0.0, last_flush + self.seconds - now)
+
+def sendmsg_all(sock, buffers):
+    """Write several buffers with as few writev/sendmsg calls as possible"""
+    if len(buffers) == 1 or not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(buffers))
+        return
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        # Drop what went out, keep the unsent tail of a partly sent buffer
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+
+def record_write(frames):
+    metrics.BYTES_OUT.inc(sum(len(frame) for frame in frames))
+    metrics.WRITES.inc()
+    metrics.FRAMES_PER_WRITE.observe(len(frames))
+
+class OutboundQueue:
+    """Bounded per-client send queue drained by a dedicated writer thread.
+
+    Producers (broadcast, auth replies) only append a pre-encoded frame (or
+    a Compressible payload) and return; the blocking send happens on the
+    writer thread, so a slow reader can only ever stall itself. The same
+    frame object is shared by every recipient of a broadcast, nothing is
+    copied per client. Frames that pile up within the coalescing window
+    leave together in one writev.
+    """
+
+    def __init__(self, sock, max_size=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST, coalesce=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.sock = sock
+        self.max_size = max_size
+        self.policy = policy
+        self.frames = deque()
+        self.dropped = 0
+        self.closed = False
+        self.codec = None  # Compresses Compressible items, once negotiated
+        self.coalesce = coalesce or CoalesceWindow()
+        self.last_flush = 0.0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, frame):
+        """Queue a frame; returns False if the client should be disconnected"""
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.frames) >= self.max_size:
+                if self.policy == DISCONNECT:
+                    self.closed = True
+                    self.frames.clear()
+                    self.condition.notify()
+                    return False
+                self.frames.popleft()
+                self.dropped += 1
+                metrics.DROPPED_FRAMES.inc()
+            self.frames.append(frame)
+            self.condition.notify()
+            return True
+
+    def depth(self):
+        return len(self.frames)
+
+    def run(self):
+        """Writer loop: send queued frames until closed"""
+        while True:
+            with self.condition:
+                while not self.frames and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.frames:
+                    return
+            
+            # Give a burst the rest of the window to pile up
+            delay = self.coalesce.delay(self.last_flush, time.monotonic())
+            if delay and not self.closed:
+                time.sleep(delay)
+            
+            with self.condition:
+                batch = [self.frames.popleft() for _ in range(min(len(self.frames), MAX_BATCH))]
+            if not batch:
+                continue  # Cleared by close() while we waited
+            frames = [
+                encode_frame(self.codec.compress(frame.payload)) if isinstance(frame, Compressible) else frame
+                for frame in batch
+            ]
+            try:
+                sendmsg_all(self.sock, frames)
+            except OSError:
+                self.close()
+                return
+            self.last_flush = time.monotonic()
+            record_write(frames)
+
+    def close(self, flush=False):
+        """Stop the writer; with flush=True already queued frames still go out"""
+        with self.condition:
+            self.closed = True
+            if not flush:
+                self.frames.clear()
+            self.condition.notify()
+
+class AsyncOutboundQueue:
+    """Event-loop counterpart of OutboundQueue backed by a writer task"""
+
+    # Stop handing frames to the transport once this much is buffered, so
+    # backlog stays in our bounded queue where the policy can act on it
+    HIGH_WATER = 64 * 1024
+
+    def __init__(self, writer, max_size=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST, coalesce=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.writer = writer
+        self.max_size = max_size
+        self.policy = policy
+        self.frames = deque()
+        self.dropped = 0
+        self.closed = False
+        self.codec = None  # Compresses Compressible items, once negotiated
+        self.coalesce = coalesce or CoalesceWindow()
+        self.last_flush = 0.0
+        self.ready = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def put(self, frame):
+        """Queue a frame; returns False if the client should be disconnected"""
+        if self.closed:
+            return False
+        if len(self.frames) >= self.max_size:
+            if self.policy == DISCONNECT:
+                self.close()
+                return False
+            self.frames.popleft()
+            self.dropped += 1
+            metrics.DROPPED_FRAMES.inc()
+        self.frames.append(frame)
+        self.ready.set()
+        return True
+
+    def depth(self):
+        return len(self.frames)
+
+    async def run(self):
+        """Writer task: hand queued frames to the transport until closed"""
+        transport = self.writer.transport
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                delay = self.coalesce.delay(self.last_flush, loop.time())
+                if delay and not self.closed:
+                    await asyncio.sleep(delay)
+                while self.frames:
+                    frames = [
+                        encode_frame(self.codec.compress(frame.payload)) if isinstance(frame, Compressible) else frame
+                        for frame in (self.frames.popleft() for _ in range(min(len(self.frames), MAX_BATCH)))
+                    ]
+                    # One transport write (one send syscall) for the whole batch
+                    self.writer.write(b"".join(frames) if len(frames) > 1 else frames[0])
+                    self.last_flush = loop.time()
+                    record_write(frames)
+                    if transport.get_write_buffer_size() > self.HIGH_WATER:
+                        await self.writer.drain()
+                if self.closed:
+                    await self.writer.drain()
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            return
+
+    def close(self, flush=False):
+        """Stop the writer task; with flush=True queued frames still go out"""
+        self.closed = True
+        if not flush:
+            self.frames.clear()
+            self.task.cancel()
+        self.ready.set()
@@ -0,0 +1,131 @@
+import threading
+import time
+from datetime import datetime
+
+class PresenceService:
+    """Who is online, on which connections, and when users were last seen.
+
+    Keeps username -> connection set for this process (a user may be
+    logged in from several devices) and username sets for every other node
+    on the backplane, so lookups by name and /who never scan sockets. A
+    node's users are forgotten when it goes down or stops being heard from
+    (see expire_remote).
+    Last-seen times are only kept in memory on login/logout and written to
+    User.last_login in one batch every flush_interval seconds, instead of
+    an UPDATE on every login.
+    """
+
+    def __init__(self, db, flush_interval=30.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.local = {}   # username -> set of connections on this node
+        self.remote = {}  # node id -> set of usernames online there
+        self.remote_seen = {}  # node id -> time.monotonic() of its last event
+        self.last_seen = {}  # username -> datetime, not yet written
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def connect(self, conn, username):
+        """Register a connection; returns True if the user just came online here"""
+        with self.lock:
+            sessions = self.local.setdefault(username, set())
+            sessions.add(conn)
+            self.last_seen[username] = datetime.utcnow()
+            return len(sessions) == 1
+
+    def disconnect(self, conn, username):
+        """Forget a connection; returns True if it was the user's last one here"""
+        with self.lock:
+            sessions = self.local.get(username)
+            if sessions is None or conn not in sessions:
+                return False
+            sessions.discard(conn)
+            self.last_seen[username] = datetime.utcnow()
+            if sessions:
+                return False
+            del self.local[username]
+            return True
+
+    def connections(self, username):
+        """Snapshot of every local connection a user is logged in on"""
+        with self.lock:
+            return tuple(self.local.get(username, ()))
+
+    def local_usernames(self):
+        with self.lock:
+            return sorted(self.local)
+
+    def online_elsewhere(self, username):
+        with self.lock:
+            return any(username in users for users in self.remote.values())
+
+    def online_users(self):
+        """Everyone online on any node, sorted"""
+        with self.lock:
+            users = set(self.local)
+            for remote_users in self.remote.values():
+                users.update(remote_users)
+        return sorted(users)
+
+    def set_remote(self, node, usernames):
+        """Replace what we know about another node (from a snapshot)"""
+        with self.lock:
+            self.remote[node] = set(usernames)
+            self.remote_seen[node] = time.monotonic()
+
+    def update_remote(self, node, username, online):
+        """Apply one presence delta published by another node"""
+        with self.lock:
+            users = self.remote.setdefault(node, set())
+            self.remote_seen[node] = time.monotonic()
+            if online:
+                users.add(username)
+            else:
+                users.discard(username)
+
+    def touch_remote(self, node):
+        """Note that a node is alive; returns False if it was unknown"""
+        with self.lock:
+            known = node in self.remote
+            self.remote.setdefault(node, set())
+            self.remote_seen[node] = time.monotonic()
+            return known
+
+    def remove_remote(self, node):
+        """Forget a node that went down; returns how many users it had"""
+        with self.lock:
+            self.remote_seen.pop(node, None)
+            return len(self.remote.pop(node, ()))
+
+    def expire_remote(self, max_age):
+        """Forget nodes not heard from for max_age seconds; returns their ids"""
+        cutoff = time.monotonic() - max_age
+        with self.lock:
+            stale = [node for node, seen in self.remote_seen.items() if seen < cutoff]
+            for node in stale:
+                del self.remote_seen[node]
+                self.remote.pop(node, None)
+        return stale
+
+    def run(self):
+        """Writer loop: flush last-seen times every flush_interval"""
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.last_seen:
+                return
+            batch, self.last_seen = self.last_seen, {}
+        self.db.record_last_seen(batch)
+
+    def close(self):
+        """Write pending last-seen times and stop the writer"""
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.flush()
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import struct
+import threading
+import zlib
+from collections import deque
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Every message on the wire is a 4-byte big-endian length followed by the
+# payload. Control messages carry UTF-8 JSON, chat lines carry UTF-8 text.
+HEADER = struct.Struct("!I")
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 1 << 20  # 1 MiB
+# Longest chat line (or command) the server accepts, in characters: far
+# below MAX_FRAME_SIZE, so replies carrying many stored lines (history,
+# search results, mail) can always be split into frames that fit
+MAX_LINE_CHARS = 16384
+RECV_SIZE = 65536
+
+# Chat payload a client sends to leave; the server then closes the session
+LEAVE_COMMAND = "[leave]"
+
+# Optional per-connection encodings, negotiated with a "hello" request
+# right after auth_required. Connections that never send one keep the
+# plain untagged format above.
+JSON_ENCODING = "json"
+MSGPACK_ENCODING = "msgpack"
+ZLIB_COMPRESSION = "zlib"
+COMPRESS_THRESHOLD = 512  # Smaller payloads are not worth compressing
+
+# Negotiated ("tagged") payloads start with one header byte: the kind of
+# body plus a flag for bodies compressed with the connection's stream
+KIND_TEXT = 0x01
+KIND_JSON = 0x02
+KIND_MSGPACK = 0x03
+FLAG_COMPRESSED = 0x80
+
+class FrameError(Exception):
+    """Raised when the peer sends a frame we refuse to decode"""
+
+def encode_frame(payload):
+    """Prefix a payload (bytes or str) with its length"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {len(payload)} bytes exceeds {MAX_FRAME_SIZE}")
+    return HEADER.pack(len(payload)) + payload
+
+def encode_json(message):
+    """Serialize a control message into a ready-to-send frame"""
+    return encode_frame(json.dumps(message).encode('utf-8'))
+
+def auth_request(kind, username, password):
+    """Login ("login") or registration ("register") request"""
+    return {"type": kind, "username": username, "password": password}
+
+def resume_request(token):
+    """Re-authenticate with a session token from a previous auth_success"""
+    return {"type": "resume", "token": token}
+
+# Heartbeats: the server pings quiet connections and either side answers
+# a ping with a pong; any received frame counts as a sign of life
+PING = {"type": "ping"}
+PONG = {"type": "pong"}
+
+def decode_json(payload):
+    """Parse a control message payload, raising ValueError on bad input"""
+    return json.loads(payload.decode('utf-8'))
+
+def supported_encodings():
+    """Encodings this process can speak, preferred first"""
+    if msgpack is not None:
+        return [MSGPACK_ENCODING, JSON_ENCODING]
+    return [JSON_ENCODING]
+
+# Optional client capabilities, listed in the hello's "features"
+MAILBOX_ACK = "mailbox_ack"  # Client confirms mailbox deliveries itself
+
+def hello_request(compression=True, encodings=None, features=()):
+    """Ask the server for a tagged encoding (and optionally compression)"""
+    return {
+        "type": "hello",
+        "encodings": encodings or supported_encodings(),
+        "compression": [ZLIB_COMPRESSION] if compression else [],
+        "features": list(features)
+    }
+
+def mailbox_ack(up_to):
+    """Confirm that every mailbox message up to this id was received"""
+    return {"type": "mailbox_ack", "up_to": up_to}
+
+class Compressible:
+    """An outbound payload the writer compresses just before sending.
+
+    The per-connection zlib stream must see payloads in exactly the order
+    they hit the wire, so compression happens on the writer, after the
+    slow consumer policy has decided what to drop.
+    """
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+class Codec:
+    """Payload encoding for one connection.
+
+    The default untagged codec is the original wire format: chat lines are
+    UTF-8 text and control messages UTF-8 JSON. A negotiated codec prefixes
+    every payload with a header byte (see KIND_*) and encodes control
+    messages as msgpack or JSON. With zlib, large server-to-client payloads
+    go through one streaming deflate context per connection, so repeated
+    history and control traffic compresses against what was sent before.
+    Text payloads carry no per-connection state, so one encoded broadcast
+    is still shared by every recipient using the same kind of codec.
+    """
+
+    def __init__(self, encoding=None, compression=None, threshold=COMPRESS_THRESHOLD):
+        if encoding == MSGPACK_ENCODING and msgpack is None:
+            raise ValueError("msgpack encoding needs the 'msgpack' package")
+        self.encoding = encoding
+        self.tagged = encoding is not None
+        self.compression = compression if self.tagged else None
+        self.threshold = threshold
+        self.compressor = None
+        self.decompressor = None
+        if self.compression == ZLIB_COMPRESSION:
+            self.compressor = zlib.compressobj(wbits=-15)
+            self.decompressor = zlib.decompressobj(wbits=-15)
+
+    def encode_text(self, text):
+        data = text.encode('utf-8')
+        return bytes((KIND_TEXT,)) + data if self.tagged else data
+
+    def encode_control(self, message):
+        if self.encoding == MSGPACK_ENCODING:
+            return bytes((KIND_MSGPACK,)) + msgpack.packb(message)
+        data = json.dumps(message).encode('utf-8')
+        return bytes((KIND_JSON,)) + data if self.tagged else data
+
+    def wants_compression(self, payload):
+        return self.compressor is not None and len(payload) >= self.threshold
+
+    def compress(self, payload):
+        """Deflate a tagged payload's body through the connection stream"""
+        body = self.compressor.compress(payload[1:]) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return bytes((payload[0] | FLAG_COMPRESSED,)) + body
+
+    def decode(self, payload, sniff_json=True):
+        """Return (is_control, message) for a received payload.
+
+        Untagged payloads are control messages when they look like JSON;
+        pass sniff_json=False where untagged payloads are always chat text.
+        Raises ValueError on malformed control messages.
+        """
+        if not self.tagged:
+            if sniff_json and payload.startswith(b"{"):
+                return True, decode_json(payload)
+            return False, payload.decode('utf-8')
+
+        if not payload:
+            raise ValueError("Empty payload")
+        kind, body = payload[0], payload[1:]
+        if kind & FLAG_COMPRESSED:
+            if self.decompressor is None:
+                raise ValueError("Compressed payload without negotiated compression")
+            # Bounded: a small frame must not inflate into gigabytes
+            body = self.decompressor.decompress(body, MAX_FRAME_SIZE)
+            if self.decompressor.unconsumed_tail:
+                raise ValueError(f"Compressed payload expands beyond {MAX_FRAME_SIZE} bytes")
+            kind &= ~FLAG_COMPRESSED
+        if kind == KIND_TEXT:
+            return False, body.decode('utf-8')
+        if kind == KIND_JSON:
+            return True, json.loads(body.decode('utf-8'))
+        if kind == KIND_MSGPACK and msgpack is not None:
+            try:
+                return True, msgpack.unpackb(body)
+            except Exception as e:
+                raise ValueError(f"Invalid msgpack payload: {e}")
+        raise ValueError(f"Unknown payload kind {kind:#x}")
+
+# Shared by every connection that did not negotiate anything
+PLAIN_CODEC = Codec()
+
+class FrameDecoder:
+    """Incremental decoder that turns arbitrary byte chunks into frames.
+
+    TCP is free to split or coalesce writes, so a single recv() may hold
+    half a frame or several frames. Feed every chunk in and collect the
+    complete payloads that come out.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """Append received bytes and return the list of complete payloads"""
+        self.buffer.extend(data)
+        frames = []
+        offset = 0
+        buffered = len(self.buffer)
+
+        while buffered - offset >= HEADER_SIZE:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_frame_size:
+                raise FrameError(f"Frame of {length} bytes exceeds {self.max_frame_size}")
+            end = offset + HEADER_SIZE + length
+            if end > buffered:
+                break
+            frames.append(bytes(self.buffer[offset + HEADER_SIZE:end]))
+            offset = end
+
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+class FramedSocket:
+    """Blocking socket wrapper that reads and writes whole frames.
+
+    Sends are serialized, so a reader thread answering pings never
+    interleaves its frame with one being sent by another thread.
+    """
+
+    def __init__(self, sock, max_frame_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.decoder = FrameDecoder(max_frame_size)
+        self.pending = deque()
+        self.codec = PLAIN_CODEC
+        self.send_lock = threading.Lock()
+
+    def send(self, payload):
+        """Send one chat line (or raw bytes) as a single frame"""
+        if isinstance(payload, str):
+            payload = self.codec.encode_text(payload)
+        with self.send_lock:
+            self.sock.sendall(encode_frame(payload))
+
+    def send_json(self, message):
+        """Send one control message"""
+        frame = encode_frame(self.codec.encode_control(message))
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+    def recv(self):
+        """Return the next payload, or None once the peer has closed"""
+        while not self.pending:
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                return None
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+    def close(self):
+        self.sock.close()
+
+async def read_frame(reader, max_frame_size=MAX_FRAME_SIZE):
+    """Read one payload from an asyncio StreamReader, None on EOF"""
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > max_frame_size:
+        raise FrameError(f"Frame of {length} bytes exceeds {max_frame_size}")
+    return await reader.readexactly(length)
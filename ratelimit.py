@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TokenBuckets:
+    """Token buckets keyed by a name (username, IP address), O(1) per check.
+
+    Each key may spend `burst` requests at once and earns `rate` tokens per
+    second back. Buckets are kept in least-recently-used order and the
+    oldest is evicted once there are more than max_keys, so memory stays
+    bounded no matter how many addresses show up; an evicted bucket was
+    idle the longest and has most likely refilled anyway. rate <= 0 turns
+    the limiter off.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> [tokens, last refill, denial reported]
+        self.lock = threading.Lock()
+
+    def check(self, key, cost=1):
+        """Spend tokens for one request.
+
+        Returns (retry_after, notify): retry_after is 0 when the request may
+        proceed, otherwise the seconds until it would; notify is True only
+        for the first denial since the key was last allowed, so a flooding
+        client gets one error frame per burst instead of one per message.
+        """
+        if self.rate <= 0:
+            return 0.0, False
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, False]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                bucket[2] = False
+                return 0.0, False
+            notify = not bucket[2]
+            bucket[2] = True
+            return (cost - bucket[0]) / self.rate, notify
+
+    def __len__(self):
+        return len(self.buckets)
+
+class RateLimit:
+    """One budget (e.g. chat messages) enforced per username and per IP.
+
+    The IP budget is ip_multiplier times the per-user one, leaving room
+    for several users behind one NAT while still stopping a single host
+    that rotates usernames.
+    """
+
+    def __init__(self, rate, burst, ip_multiplier=5.0, max_keys=100000):
+        self.users = TokenBuckets(rate, burst, max_keys)
+        self.ips = TokenBuckets(rate * ip_multiplier, burst * ip_multiplier, max_keys)
+
+    def check(self, username, ip):
+        """(retry_after, notify) for a request by username from ip"""
+        retry_after, notify = self.ips.check(ip)
+        if retry_after:
+            return retry_after, notify
+        return self.users.check(username)
@@ -0,0 +1,58 @@
+import re
+import threading
+
+DEFAULT_ROOM = "lobby"
+ROOM_NAME = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+class RoomManager:
+    """Room membership index for message routing.
+
+    Keeps room -> member set and connection -> (username, room), so a room
+    message costs O(room size) instead of a walk over every socket. Each
+    connection is in exactly one room at a time. Finding a user's
+    connections by name is the PresenceService's job.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms = {}        # room -> set of connections
+        self.connections = {}  # connection -> (username, room)
+
+    def join(self, conn, username, room=DEFAULT_ROOM):
+        """Move a connection into a room; returns the room it left (or None)"""
+        with self.lock:
+            previous = self._detach(conn)
+            self.rooms.setdefault(room, set()).add(conn)
+            self.connections[conn] = (username, room)
+            return previous
+
+    def remove(self, conn):
+        """Forget a connection entirely; returns the room it was in"""
+        with self.lock:
+            return self._detach(conn)
+
+    def _detach(self, conn):
+        entry = self.connections.pop(conn, None)
+        if entry is None:
+            return None
+        _, room = entry
+
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(conn)
+            if not members and room != DEFAULT_ROOM:
+                del self.rooms[room]
+        return room
+
+    def room_of(self, conn):
+        entry = self.connections.get(conn)
+        return entry[1] if entry else None
+
+    def members(self, room):
+        """Snapshot of a room's connections, safe to iterate while others churn"""
+        with self.lock:
+            return tuple(self.rooms.get(room, ()))
+
+    def room_sizes(self):
+        with self.lock:
+            return {room: len(members) for room, members in self.rooms.items()}
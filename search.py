@@ -0,0 +1,141 @@
+import bisect
+import re
+import threading
+from collections import OrderedDict
+from rooms import ROOM_NAME
+
+TOKEN = re.compile(r"\w+")
+PAGE_SIZE = 10
+SEARCH_SCAN = 5000  # Index hits examined per query, whatever the filters
+SNIPPET_CHARS = 1000  # Message text shown per hit, so a page always fits one frame
+
+USAGE = "Usage: /search <words> [from:<user>] [in:<room>] [before:<id>]"
+
+def tokenize(text):
+    """Lower-cased words, the same way SQLite's unicode61 tokenizer splits them"""
+    return TOKEN.findall(text.casefold())
+
+def snippet(content):
+    """A hit's text, cut at SNIPPET_CHARS"""
+    return content if len(content) <= SNIPPET_CHARS else content[:SNIPPET_CHARS] + "…"
+
+def parse_query(arg):
+    """Split '/search' arguments into terms and filters; ValueError if unusable"""
+    query = {"terms": [], "username": None, "room": None, "before": None}
+    for word in arg.split():
+        key, _, value = word.partition(":")
+        if key == "from" and value:
+            query["username"] = value
+        elif key == "in" and value:
+            room = value.lstrip("#")
+            if not ROOM_NAME.match(room):
+                raise ValueError(USAGE)
+            query["room"] = room
+        elif key == "before" and value:
+            if not value.isdigit():
+                raise ValueError(USAGE)
+            query["before"] = int(value)
+        else:
+            query["terms"].extend(tokenize(word))
+    if not query["terms"]:
+        raise ValueError(USAGE)
+    return query
+
+class InvertedIndex:
+    """In-process full-text index over the newest max_messages messages.
+
+    Fallback for databases without FTS5 (e.g. PostgreSQL). Every term maps
+    to the ascending ids of the messages containing it, so a query only
+    walks the postings of its rarest term, newest first, starting from a
+    binary search for the page cursor. Ids are local sequence numbers.
+    The oldest messages are evicted past max_messages; since eviction is
+    oldest-first their postings form a prefix that is trimmed lazily.
+    """
+
+    def __init__(self, max_messages=200000):
+        self.max_messages = max_messages
+        self.messages = OrderedDict()  # id -> (row, set of terms)
+        self.postings = {}  # term -> [ids ascending, evicted prefix length]
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def add(self, rows):
+        """Index a batch of stored message rows"""
+        with self.lock:
+            for row in rows:
+                message_id = self.next_id
+                self.next_id += 1
+                terms = set(tokenize(row["content"]))
+                self.messages[message_id] = (row, terms)
+                for term in terms:
+                    self.postings.setdefault(term, [[], 0])[0].append(message_id)
+            while len(self.messages) > self.max_messages:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        _, (_, terms) = self.messages.popitem(last=False)
+        for term in terms:
+            entry = self.postings[term]
+            entry[1] += 1
+            ids, evicted = entry
+            if evicted == len(ids):
+                del self.postings[term]
+            elif evicted > 64 and evicted * 2 > len(ids):
+                del ids[:evicted]
+                entry[1] = 0
+
+    def search(self, terms, room=None, username=None, before=None, limit=PAGE_SIZE, scan=SEARCH_SCAN):
+        """Newest messages containing every term; returns (rows, next_before)"""
+        wanted = set(terms)
+        with self.lock:
+            entries = [self.postings.get(term) for term in wanted]
+            if not entries or None in entries:
+                return [], None
+            ids, evicted = min(entries, key=lambda entry: len(entry[0]) - entry[1])
+            end = bisect.bisect_left(ids, before) if before is not None else len(ids)
+            results = []
+            for position in range(end - 1, max(evicted, end - scan) - 1, -1):
+                message_id = ids[position]
+                row, message_terms = self.messages[message_id]
+                if room is not None and row["room"] != room:
+                    continue
+                if username is not None and row["username"] != username:
+                    continue
+                if not wanted <= message_terms:
+                    continue
+                results.append(dict(row, id=message_id))
+                if len(results) == limit:
+                    return results, message_id
+            # Stopped at the scan cap: the caller may continue from there
+            start = max(evicted, end - scan)
+            return results, (ids[start] if start > evicted else None)
+
+class MessageSearch:
+    """Backs /search with the database's FTS5 index when it has one.
+
+    Otherwise an InvertedIndex is primed with recent history and fed every
+    batch the history writer stores; it then only covers messages that
+    passed through this process.
+    """
+
+    def __init__(self, db, max_messages=200000):
+        self.db = db
+        self.index = None
+        if not db.full_text_search:
+            self.index = InvertedIndex(max_messages)
+            self.index.add(db.recent_messages(None, max_messages))
+
+    def add(self, rows):
+        """Index a batch just written by the history writer"""
+        if self.index is not None:
+            self.index.add(rows)
+
+    def search(self, query, limit=PAGE_SIZE):
+        """Run a parse_query() result; returns (rows newest first, next_before)"""
+        if self.index is not None:
+            return self.index.search(
+                query["terms"], query["room"], query["username"], query["before"], limit
+            )
+        return self.db.search_messages(
+            query["terms"], query["room"], query["username"], query["before"], limit, SEARCH_SCAN
+        )
@@ -0,0 +1,201 @@
+import argparse
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import time
+from authserver import parse_args, run_server
+from backplane import DEFAULT_SOCKET_PATH
+from database import prepare_database
+
+class Supervisor:
+    """Forks N server workers that share one port through SO_REUSEPORT.
+
+    The kernel load-balances new connections across the workers, so
+    accepting scales with cores. Crashed workers are restarted; one that
+    keeps exiting within min_uptime seconds of starting is restarted with
+    exponential backoff, and given up on after max_fast_exits such exits
+    in a row (run() then returns False). On SIGTERM/SIGINT every worker is
+    asked to stop and given a grace period to drain before being killed.
+    Unless another backplane is configured, a Unix socket broker is
+    started so users on different workers still share rooms.
+    """
+
+    def __init__(self, server_args, workers=None, grace=10.0, restart_delay=1.0,
+                 max_restart_delay=60.0, min_uptime=10.0, max_fast_exits=5):
+        self.server_args = server_args
+        self.workers = workers or os.cpu_count() or 1
+        self.grace = grace
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.min_uptime = min_uptime
+        self.max_fast_exits = max_fast_exits
+        self.children = {}  # pid -> worker slot
+        self.started = {}  # slot -> time.monotonic() of its last start
+        self.fast_exits = {}  # slot -> exits in a row soon after starting
+        self.restarts = {}  # slot -> time.monotonic() its restart is due
+        self.broker = None
+        self.stopping = False
+        self.failed = False
+
+    def start_broker(self):
+        """Run a backplane broker process unless one was configured"""
+        if self.server_args.backplane:
+            return
+        path = f"{DEFAULT_SOCKET_PATH}.{os.getpid()}"
+        self.broker = subprocess.Popen([
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backplane.py"),
+            "--socket", path
+        ], start_new_session=True)  # Ctrl+C reaches the supervisor only; it stops the broker last
+        # Wait for the broker to bind before workers try to connect
+        deadline = time.monotonic() + 5
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.server_args.backplane = f"unix://{path}"
+
+    def spawn(self, slot):
+        """Fork one worker; the child never returns from here"""
+        pid = os.fork()
+        if pid == 0:
+            # Child: default signal handling, SIGTERM behaves like Ctrl+C
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, self.worker_stop_handler)
+            if self.server_args.metrics_port:
+                # One admin port per worker: base port + slot
+                self.server_args.metrics_port += slot
+            exit_code = 0
+            try:
+                if not run_server(self.server_args):
+                    exit_code = 1
+            except Exception as e:
+                print(f"❌ Worker {slot} crashed: {e}")
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(exit_code)
+        self.children[pid] = slot
+        self.started[slot] = time.monotonic()
+        print(f"👷 Worker {slot} started (pid {pid})")
+
+    @staticmethod
+    def worker_stop_handler(signum, frame):
+        raise KeyboardInterrupt
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        """Start the workers and keep them alive until told to stop.
+
+        Returns False if a worker had to be given up on.
+        """
+        self.server_args.reuse_port = True
+        # All workers must accept each other's session resume tokens
+        os.environ.setdefault("CHAT_TOKEN_SECRET", secrets.token_hex(32))
+        prepare_database(self.server_args.db_url)
+        self.start_broker()
+
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        for slot in range(self.workers):
+            self.spawn(slot)
+        print(f"🧭 Supervisor managing {self.workers} workers on {self.server_args.host}:{self.server_args.port}")
+
+        while not self.stopping:
+            self.restart_due()
+            if not self.children and not self.restarts:
+                break  # Every worker was given up on
+            # Poll so a stop signal is noticed promptly (waitpid retries on EINTR)
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if not pid:
+                time.sleep(0.2)
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is None or self.stopping:
+                continue
+            self.schedule_restart(slot, pid, os.waitstatus_to_exitcode(status))
+
+        self.shutdown()
+        return not self.failed
+
+    def schedule_restart(self, slot, pid, exit_code):
+        """Restart an exited worker later, backing off while it keeps failing fast"""
+        if time.monotonic() - self.started.get(slot, 0) < self.min_uptime:
+            self.fast_exits[slot] = self.fast_exits.get(slot, 0) + 1
+        else:
+            self.fast_exits[slot] = 0
+        fast_exits = self.fast_exits[slot]
+        if fast_exits >= self.max_fast_exits:
+            print(
+                f"🛑 Worker {slot} exited {fast_exits} times within {self.min_uptime:g}s of "
+                f"starting (last status {exit_code}), not restarting it"
+            )
+            self.failed = True
+            return
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** max(0, fast_exits - 1))
+        print(f"♻️ Worker {slot} (pid {pid}) exited with status {exit_code}, restarting in {delay:g}s")
+        self.restarts[slot] = time.monotonic() + delay
+
+    def restart_due(self):
+        now = time.monotonic()
+        for slot, due in list(self.restarts.items()):
+            if due <= now:
+                del self.restarts[slot]
+                self.spawn(slot)
+
+    def shutdown(self):
+        """Ask every worker to stop, then kill whatever outlives the grace period"""
+        print(f"\n🛑 Stopping {len(self.children)} workers...")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+
+        deadline = time.monotonic() + self.grace
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in list(self.children):
+            print(f"⚠️ Worker pid {pid} did not drain in time, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.clear()
+
+        if self.broker is not None:
+            self.broker.send_signal(signal.SIGINT)
+            self.broker.wait(timeout=5)
+        print("✅ Supervisor stopped")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run several Auth Chat Server workers on one port",
+        epilog="Any other option is passed to every worker (see authserver.py --help)."
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--grace", type=float, default=10.0, help="Seconds workers get to drain on shutdown")
+    args, server_argv = parser.parse_known_args()
+    server_args = parse_args(server_argv)
+    if server_args.handoff_socket or server_args.take_over:
+        parser.error("--handoff-socket/--take-over hand over a single server's socket; not for workers")
+
+    supervisor = Supervisor(server_args, workers=args.workers, grace=args.grace)
+    sys.exit(0 if supervisor.run() else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import select
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+def server_context(certfile, keyfile=None):
+    """TLS context for the server.
+
+    TLS 1.2+ only. Each handshake issues one TLS 1.3 session ticket, so a
+    client that reconnects with its saved session skips the certificate
+    and its signature. Tickets are encrypted with a key held by this
+    context; server processes do not share it.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    context.num_tickets = 1  # A client only ever resumes its latest session
+    return context
+
+def client_context(cafile=None, verify=True):
+    """TLS context for clients; cafile trusts e.g. a self-signed server cert"""
+    context = ssl.create_default_context(cafile=cafile)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+def generate_self_signed(certfile, keyfile, hostname="localhost", days=365):
+    """Write a self-signed certificate for local testing (needs the openssl CLI).
+
+    The key is ECDSA P-256: its handshakes cost far less CPU than RSA.
+    """
+    subprocess.run([
+        "openssl", "req", "-x509", "-nodes", "-days", str(days),
+        "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+        "-keyout", keyfile, "-out", certfile, "-subj", f"/CN={hostname}",
+        "-addext", f"subjectAltName=DNS:{hostname},DNS:localhost,IP:127.0.0.1"
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+class TLSSocket:
+    """An SSLSocket safe to read on one thread while another writes.
+
+    OpenSSL forbids using one connection from two threads at once, but the
+    threaded server reads on each client's thread while its outbound
+    writer thread sends. The socket is made non-blocking and every TLS call runs
+    under a lock; waiting for the network happens outside it, so a reader
+    parked on an idle connection never holds up writes (and a writer
+    waiting for buffer space never holds up reads). Each wait polls with
+    its own poll object, since one cannot be polled from two threads.
+    shutdown() goes straight to the TCP socket and wakes both sides.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # Keeps concurrent sendall()s whole
+        sock.setblocking(False)
+
+    def wait(self, events, timeout=None):
+        """Block until the socket is ready for events; False on timeout"""
+        poller = select.poll()
+        poller.register(self.sock.fileno(), events)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+
+    def run(self, operation, *args, timeout=None):
+        """Retry a TLS call until it completes, waiting for I/O between tries"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self.lock:
+                try:
+                    return operation(*args)
+                except ssl.SSLWantReadError:
+                    events = select.POLLIN
+                except ssl.SSLWantWriteError:
+                    events = select.POLLOUT
+            if deadline is None:
+                self.wait(events)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.wait(events, remaining):
+                raise socket.timeout("TLS handshake timed out")
+
+    def do_handshake(self, timeout=None):
+        self.run(self.sock.do_handshake, timeout=timeout)
+
+    def recv(self, size):
+        return self.run(self.sock.recv, size)
+
+    def sendall(self, data):
+        view = memoryview(data)
+        with self.send_lock:
+            while view:
+                view = view[self.run(self.sock.send, view):]
+
+    def shutdown(self, how):
+        socket.socket.shutdown(self.sock, how)
+
+    def close(self):
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def setsockopt(self, *args):
+        self.sock.setsockopt(*args)
+
+    @property
+    def session(self):
+        return self.sock.session
+
+    @property
+    def session_reused(self):
+        return self.sock.session_reused
+
+class ResumingContext:
+    """Client TLS context for asyncio that offers the last session again.
+
+    asyncio has no session= option, but all it asks of its ssl context is
+    wrap_bio(), so this wrapper supplies the saved session there.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.session = None  # Set from the ssl_object after a handshake
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None):
+        return self.context.wrap_bio(
+            incoming, outgoing, server_side, server_hostname, session=self.session
+        )
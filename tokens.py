@@ -0,0 +1,66 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class SessionTokens:
+    """Signed, expiring session tokens for cheap reconnects.
+
+    A token is base64(payload) + "." + base64(HMAC-SHA256(payload)), where
+    the payload names the user and an expiry time. Verifying one is a
+    single HMAC with no database or bcrypt work. Every server process that
+    should accept a token needs the same secret (CHAT_TOKEN_SECRET);
+    without it a random per-process secret is used (generated is True),
+    which a server taking over from another adopts instead.
+    """
+
+    def __init__(self, secret=None, ttl=3600):
+        if secret is None:
+            secret = os.environ.get("CHAT_TOKEN_SECRET")
+        self.generated = secret is None
+        if secret is None:
+            secret = secrets.token_bytes(32)
+        elif isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self.secret = secret
+        self.ttl = ttl
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()
+
+    def issue(self, username):
+        """Create a token for an authenticated user"""
+        payload = json.dumps(
+            {"u": username, "exp": int(time.time() + self.ttl)},
+            separators=(",", ":")
+        ).encode('utf-8')
+        return f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}"
+
+    def verify(self, token):
+        """Return the username a valid token was issued to, else None"""
+        try:
+            encoded_payload, encoded_signature = token.split(".", 1)
+            payload = _b64decode(encoded_payload)
+            signature = _b64decode(encoded_signature)
+        except (AttributeError, ValueError):
+            return None
+
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+
+        try:
+            claims = json.loads(payload)
+        except ValueError:
+            return None
+        if claims.get("exp", 0) < time.time():
+            return None
+        return claims.get("u")